@@ -37,9 +37,9 @@ class AutoQueries:
         """
         Given a NamedIndividual name, get its properties values
         """
-        record = await tx.run(f"""
-            MATCH (n:NamedIndividual {{name: '{indiv_name}'}}) RETURN n {{.*}} AS props
-            """)
+        record = await tx.run("""
+            MATCH (n:NamedIndividual {name: $indiv_name}) RETURN n {.*} AS props
+            """, indiv_name=indiv_name)
         record = await record.single()
         props_dict = record['props']
         for sys_prop in sys_labels:
@@ -120,9 +120,9 @@ class AutoQueries:
 
     @staticmethod
     async def get_class(tx, indiv_name: str) -> list:
-        records = await tx.run(f"""
-            MATCH (n:NamedIndividual {{name: '{indiv_name}'}})-[:MEMBEROF]->(c:Class) RETURN c.name AS cls
-            """)
+        records = await tx.run("""
+            MATCH (n:NamedIndividual {name: $indiv_name})-[:MEMBEROF]->(c:Class) RETURN c.name AS cls
+            """, indiv_name=indiv_name)
         results: list = []
         async for record in records:
             results.append(record['cls'])
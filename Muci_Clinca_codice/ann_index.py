@@ -0,0 +1,132 @@
+import math
+
+import numpy as np
+
+from embedding_model import EmbeddingMatrix
+
+
+class IVFIndex:
+    """
+    Approximate nearest-neighbour index (Inverted File) over an EmbeddingMatrix.
+    The rows are clustered with spherical k-means; a search only scores the rows
+    of the n_probe clusters closest to the query.
+    """
+    min_rows = 1000  # under this size, the exact search is already fast enough
+
+    def __init__(self, embeddings: EmbeddingMatrix, n_lists: int = None, n_probe: int = 8,
+                 iterations: int = 10, train_size: int = 50000, seed: int = 0,
+                 centroids: np.ndarray = None):
+        """
+        Build the index
+        :param embeddings: the embedded elements of an auto-query
+        :param n_lists: number of clusters (None = square root of the number of rows)
+        :param n_probe: number of clusters scored by each search
+        :param iterations: k-means iterations
+        :param train_size: maximum number of rows used to train the centroids
+        :param seed: random seed, for reproducible indexes
+        :param centroids: already trained centroids: the rows are only assigned to them (no k-means)
+        """
+        self.embeddings: EmbeddingMatrix = embeddings
+        self.n_probe: int = max(1, n_probe)
+        self.centroids: np.ndarray | None = None
+        self.lists: list[np.ndarray] = []  # row indexes of each cluster
+
+        n_rows = len(embeddings)
+        if n_rows < self.min_rows:
+            return  # exact search
+
+        if centroids is None:
+            if n_lists is None:
+                n_lists = int(math.sqrt(n_rows))
+            n_lists = max(1, min(n_lists, n_rows))
+            centroids = self.train(embeddings, n_lists, iterations, train_size, seed)
+        n_lists = len(centroids)
+
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+
+        assignment = np.empty(n_rows, dtype=np.int64)
+        for start in range(0, n_rows, train_size):  # assign all the rows, chunk by chunk
+            block = embeddings.vectors(slice(start, start + train_size))
+            assignment[start:start + train_size] = np.argmax(block @ self.centroids.T, axis=1)
+
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(n_lists + 1))
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(n_lists)]
+
+    @staticmethod
+    def train(embeddings: EmbeddingMatrix, n_lists: int, iterations: int, train_size: int, seed: int) -> np.ndarray:
+        """
+        Train the centroids with spherical k-means, on a sample of the rows
+        """
+        n_rows = len(embeddings)
+        rng = np.random.default_rng(seed)
+
+        train_rows = rng.choice(n_rows, size=min(train_size, n_rows), replace=False)
+        train = embeddings.vectors(train_rows)
+        centroids = train[rng.choice(len(train), size=n_lists, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignment = np.argmax(train @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = train[assignment == c]
+                if len(members) > 0:  # empty clusters keep their centroid
+                    centroids[c] = members.sum(axis=0)
+            centroids = EmbeddingMatrix.normalize(centroids)
+        return centroids
+
+    def search(self, query_emb: np.ndarray, k_lim: int = 10, thresh: float = 0.65) -> list[int]:
+        """
+        Same as EmbeddingMatrix.top_k, but only on the rows of the closest clusters
+        :return: the row indexes, by descending similarity
+        """
+        if self.centroids is None:
+            return self.embeddings.top_k(query_emb, k_lim=k_lim, thresh=thresh)
+
+        query = EmbeddingMatrix.normalize(np.asarray(query_emb, dtype=np.float32))
+        centroid_scores = self.centroids @ query
+
+        n_probe = min(self.n_probe, len(self.lists))
+        probes = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        rows = np.concatenate([self.lists[c] for c in probes])
+
+        return self.embeddings.top_k(query_emb, k_lim=k_lim, thresh=thresh, rows=rows)
+
+    def recall_at_k(self, k: int = 10, n_queries: int = 100, seed: int = 0,
+                    queries: np.ndarray = None, noise: float = 1.0) -> float:
+        """
+        Measure the recall@k against the exact search.
+        By default, the queries are stored rows moved in a random direction: a stored row would be its own
+        exact top-1, in a cluster that is always probed, and the recall would be inflated
+        :param queries: query embeddings (e.g. of real questions); None = perturbed stored rows
+        :param noise: length of the perturbation of the (normalized) rows; with 1.0, a query has about 0.7 cosine
+        similarity with its row, as a question with the schema elements it mentions
+        :return: average fraction of the exact top-k found by the index
+        """
+        n_rows = len(self.embeddings)
+        if n_rows == 0:
+            return 1.0
+
+        rng = np.random.default_rng(seed)
+        if queries is None:
+            rows = self.embeddings.vectors(rng.choice(n_rows, size=min(n_queries, n_rows), replace=False))
+            directions = rng.standard_normal(rows.shape).astype(np.float32)
+            directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+            queries = rows + noise * directions
+
+        found = 0
+        expected = 0
+        for query in queries:
+            exact = set(self.embeddings.top_k(query, k_lim=k, thresh=-np.inf))
+            approx = set(self.search(query, k_lim=k, thresh=-np.inf))
+            found += len(exact & approx)
+            expected += len(exact)
+        return found / expected
+
+
+# Index types, selectable in config['aq_tuple'] (e.g. 'dense-klim/ivf')
+ann_indexes = {
+    'ivf': IVFIndex,
+}
+
+if __name__ == "__main__":
+    pass
@@ -1,81 +1,210 @@
 
 import random
 
-from configuration import sys_labels
+from configuration import sys_labels, config
+from neo4j_client import QueryTextStats
+from utilities.lru_cache import LRUCache
 
 
 class AutoQueries:
 
+    # Prepared query texts: they never change, the values are always passed as $parameters,
+    # so Neo4j plans each of them only once
+    queries = {
+        'names': """
+            MATCH (n:NamedIndividual)
+            RETURN COLLECT(n.name) AS names
+            """,
+        'names page': """
+            MATCH (n:NamedIndividual) WHERE n.name > $after
+            RETURN DISTINCT n.name AS name ORDER BY name LIMIT $page_size
+            """,
+        'names index': """
+            SHOW INDEXES YIELD type, labelsOrTypes, properties
+            WHERE type = 'RANGE' AND labelsOrTypes = ['NamedIndividual'] AND properties[0] = 'name'
+            RETURN count(*) > 0 AS found
+            """,
+        'create names index': """
+            CREATE INDEX named_individual_name IF NOT EXISTS FOR (n:NamedIndividual) ON (n.name)
+            """,
+        'properties list': """
+            UNWIND $names AS indiv_name
+            MATCH (n:NamedIndividual {name: indiv_name})
+            RETURN indiv_name, [key IN keys(n) WHERE NOT key IN $sys_labels | [key, n[key]]] AS props
+            """,
+        'relationships': """
+            CALL db.relationshipTypes()
+            """,
+        'labels': """
+            CALL db.labels()
+            """,
+        'introspection': """
+            CALL {
+                CALL db.labels() YIELD label
+                WITH label WHERE NOT toLower(label) IN $sys_labels
+                RETURN collect(label) AS labels
+            }
+            CALL {
+                CALL db.relationshipTypes() YIELD relationshipType
+                WITH relationshipType WHERE NOT relationshipType IN $sys_labels
+                RETURN collect(relationshipType) AS relationships
+            }
+            CALL {
+                MATCH (n:NamedIndividual) WHERE $with_names
+                RETURN collect(n.name) AS names
+            }
+            RETURN labels, relationships, names
+            """,
+        'introspection details': """
+            CALL {
+                CALL db.propertyKeys() YIELD propertyKey
+                WITH propertyKey WHERE NOT propertyKey IN $sys_labels
+                RETURN collect(propertyKey) AS property_keys
+            }
+            CALL {
+                MATCH (n:NamedIndividual) WHERE $with_names
+                UNWIND labels(n) AS label
+                WITH label, collect(n.name) AS members WHERE NOT toLower(label) IN $sys_labels
+                RETURN collect({label: label, names: members}) AS membership
+            }
+            CALL {
+                MATCH (a)-[r]->(b) WHERE NOT type(r) IN $sys_labels
+                WITH DISTINCT
+                    [l IN labels(a) WHERE NOT toLower(l) IN $sys_labels] AS source,
+                    type(r) AS relationship,
+                    [l IN labels(b) WHERE NOT toLower(l) IN $sys_labels] AS target
+                RETURN collect({source: source, relationship: relationship, target: target}) AS patterns
+            }
+            RETURN property_keys, membership, patterns
+            """,
+    }
+    text_stats = QueryTextStats()  # repeated texts of the auto-queries
+    # property maps of the individuals, by name: they rarely change
+    properties_cache = LRUCache(max_size=config['props_cache_size'], ttl=config['props_cache_ttl'])
+
+    @staticmethod
+    async def run_query(tx, query_name: str, **params) -> list:
+        """
+        Run a prepared query and record its summary in the query text statistics
+        :param query_name: key of the query in AQ.queries
+        :param params: the query parameters
+        :return: the list of records
+        """
+        result = await tx.run(AQ.queries[query_name], params)
+        records = [record async for record in result]
+        AQ.text_stats.record(query_name, await result.consume())
+        return records
+
+    @staticmethod
+    async def schema_introspection(tx, with_names: bool = True, with_details: bool = False) -> dict:
+        """
+        Retrieves the initial schema with a single query: labels, relationship types and NamedIndividual names.
+        System labels are filtered out.
+        :param with_names: if False, names and membership are left empty (e.g. when the names are paged)
+        :param with_details: also retrieve property keys, label -> names membership and relationship patterns
+        (a second query, that scans all the relationships)
+        """
+        records = await AQ.run_query(tx, 'introspection', sys_labels=list(sys_labels), with_names=with_names)
+        schema = records[0].data()
+        if with_details:
+            records = await AQ.run_query(tx, 'introspection details', sys_labels=list(sys_labels),
+                                         with_names=with_names)
+            schema.update(records[0].data())
+        return schema
+
     @staticmethod
     async def get_names(tx):
         """
         Retrieves the 'name' property of all nodes labeled as NamedIndividual.
         """
-        records = await tx.run(f"""
-               MATCH (n:NamedIndividual) 
-               RETURN COLLECT(n.name) as names
-               """)
-        record = await records.single()
-        return record.get('names')
+        records = await AQ.run_query(tx, 'names')
+        return records[0].get('names')
+
+    @staticmethod
+    async def get_names_page(tx, after: str = '', page_size: int = 5000) -> list[str]:
+        """
+        Retrieves a page of NamedIndividual names, in alphabetical order (keyset pagination)
+        :param after: last name of the previous page
+        :param page_size: maximum number of names
+        """
+        records = await AQ.run_query(tx, 'names page', after=after, page_size=page_size)
+        return [record['name'] for record in records]
+
+    @staticmethod
+    async def names_index(tx, create: bool = False) -> bool:
+        """
+        Checks the index on NamedIndividual(name): without it, each page scans and sorts all the names
+        :param create: create the index, if missing (a schema write)
+        :return: True if the index exists
+        """
+        if create:
+            await AQ.run_query(tx, 'create names index')
+            return True
+        records = await AQ.run_query(tx, 'names index')
+        return records[0]['found']
 
     @staticmethod
-    async def get_properties(tx, indiv_name: str) -> dict:
-        """
-        Given a NamedIndividual name, get its properties values.
-        Filters out system properties defined in sys_labels.
-        """
-        record = await tx.run(f"""
-            MATCH (n:NamedIndividual {{name: '{indiv_name}'}}) RETURN n {{.*}} AS props
-            """)
-        record = await record.single()
-        props_dict = record['props']
-        for sys_prop in sys_labels:
-            if sys_prop in props_dict.keys():
-                # delete the system keys
-                props_dict.pop(sys_prop, None)
-        return props_dict
+    async def get_properties_list(tx, indiv_names: list[str]) -> list[dict]:
+        """
+        Given a list of NamedIndividual names, get their properties values with a single query.
+        System properties defined in sys_labels are filtered out by the server.
+        The maps are served from AQ.properties_cache when possible: only the missing ones are read.
+        :return: the properties dictionaries, in the same order of the names (missing individuals are skipped)
+        """
+        cache = AQ.properties_cache
+        props_by_name: dict = {}
+        for name in indiv_names:
+            props = cache.get(name)
+            if props is not None:
+                props_by_name[name] = props
+
+        missing = [name for name in dict.fromkeys(indiv_names) if name not in props_by_name]
+        if missing:
+            records = await AQ.run_query(tx, 'properties list', names=missing, sys_labels=list(sys_labels))
+            for record in records:
+                if record['indiv_name'] not in props_by_name:
+                    props_by_name[record['indiv_name']] = dict(record['props'])
+                    cache.put(record['indiv_name'], props_by_name[record['indiv_name']])
+
+        return [dict(props_by_name[name]) for name in indiv_names if name in props_by_name]
+
+    @staticmethod
+    def invalidate_properties(indiv_names: list[str] = None) -> None:
+        """
+        Drop some cached property maps (None = all of them), e.g. after a change of the graph
+        """
+        AQ.properties_cache.invalidate(indiv_names)
 
     @staticmethod
     async def object_properties(tx, schema: dict = None, max_lim: int = 3, randomizer: bool = False) -> list:
         """
         Given the (full or filtered) schema, extract property values from some objects.
-        It uses the 'NAMES' list from the schema to fetch properties for the first c_lim individuals.
+        It uses the 'NAMES' list from the schema to fetch properties for the first max_lim individuals,
+        with a single query.
         """
         if schema is None or 'NAMES' not in schema.keys():
             # print('schema is null')
             return []  # nothing
 
-        names: list = schema['NAMES'].copy()
-        if max_lim > len(names):
-            max_lim = len(names)
-
-        if not isinstance(names, list):
-            return []  # nothing
-
-        objs_prop: list = []  # list of dictionaries
+        names: list = list(schema['NAMES'])
         if randomizer:
             random.shuffle(names)
 
-        c = 0
-        for pair in names:
-            # in the full schema we have name in [0] and embedding in [1]
-            c += 1
-            objs_prop.append(await AQ.get_properties(tx, pair[0]))
-
-            if c == max_lim:
-                break
-
-        return objs_prop
+        # in the full schema we have name in [0] and embedding in [1]
+        if max_lim > 0:  # 0 = no limit
+            names = names[:max_lim]
+        chosen_names = [pair[0] for pair in names]
+        if not chosen_names:
+            return []
+        return await AQ.get_properties_list(tx, chosen_names)
 
     @staticmethod
     async def relationships_names(tx, c_lim: int = 0):
-        records = await tx.run(f"""
-                   CALL db.relationshipTypes();
-                   """)
+        records = await AQ.run_query(tx, 'relationships')
         relations = set()
 
         c = 0
-        async for record in records:
+        for record in records:
             name = record["relationshipType"]
             if name in sys_labels:
                 continue
@@ -91,11 +220,9 @@ class AutoQueries:
         """
         Retrieves all labels present in the database, excluding system labels.
         """
-        records = await tx.run(f"""
-            CALL db.labels()
-            """)
+        records = await AQ.run_query(tx, 'labels')
         labels: list = []
-        async for record in records:
+        for record in records:
             if record['label'].lower() not in sys_labels:
                 labels.append(record['label'])
         return labels
@@ -105,26 +232,36 @@ class AutoQueries:
     function = 'function'  # get the real function
     results_format = 'results'  # how to format the outputs
     text_heading = 'heading'  # heading to introduce this piece of data to LLM during the transcription
+    dependencies = 'dependencies'  # filtered schema entries required before launching the auto-query
+    introspection = 'introspection'  # field of the introspection query with the same results
+    pager = 'pager'  # function that reads the results page by page
+    pager_index = 'pager index'  # function that checks (or creates) the index used by the pager
 
     global_aq_dict = {
         'NAMES': {
             function: get_names,
             results_format: 'list',
+            introspection: 'names',
+            pager: get_names_page,
+            pager_index: names_index,
             text_heading: "Use these values for the 'name' property",
         },
         'LABELS': {
             function: labels_names,
             results_format: 'list',
+            introspection: 'labels',
             text_heading: "These are the class labels: ",  # *don't invent other labels*
         },
         'OBJECT PROPERTIES': {
             function: object_properties,
             results_format: 'list > dict',
             text_heading: "Here's some property values",
+            dependencies: ('NAMES',),
         },
         'RELATIONSHIPS NAMES': {
             function: relationships_names,
             results_format: 'list',
+            introspection: 'relationships',
             text_heading: "These are the relationships: *don't invent other relationships*",
         }
     }  # all possible Auto_queries
@@ -11,6 +11,15 @@ config = defaultdict()
 config['n4j_usr'] = 'neo4j'  # Neo4j Username
 config['n4j_psw'] = None  # Neo4j Password
 config['n4j_url'] = 'bolt://localhost:7687'  # Neo4j URI/URL
+config['n4j_cache_size'] = 0  # Cached results of the generated queries (0 = disabled)
+config['n4j_cache_bytes'] = 16_000_000  # Byte budget of the cached results
+config['n4j_fetch_size'] = 100  # Records fetched from Neo4j at a time
+config['n4j_max_rows'] = 100  # Maximum number of records passed to the answer (None = no limit)
+config['n4j_preflight'] = True  # Check the generated queries with EXPLAIN before running them
+config['n4j_max_estimated_rows'] = 1_000_000  # Pre-flight budget: maximum rows estimated for an operator
+config['n4j_max_hops'] = 5  # Pre-flight upper bound of the unbounded variable-length relationships
+config['n4j_timeout'] = 30  # Seconds after which the server terminates a generated query (None = server default)
+config['n4j_parameterize'] = True  # Lift the literals of the generated queries into parameters (plan reuse)
 
 
 # LANGUAGE MODEL
@@ -26,6 +35,7 @@ config['quit_key_words'] = (
     "bye", "bye bye", "close",
     "esc", "exit", "goodbye", "quit",
 )  # Keywords to quit the chat
+config['refresh_key_words'] = ("refresh", "reload",)  # Keywords to read the schema again after a graph change
 
 # EMBEDDING MODEL
 config['embedder'] = 'qwen3-embedding:0.6b'
@@ -34,14 +44,22 @@ config['embedder'] = 'qwen3-embedding:0.6b'
 'nomic-embed-text-v2-moe:latest'
 'qwen3-embedding:0.6b'
 """
+config['emb_batch_size'] = 64  # Number of texts sent in a single embedding request
+config['emb_concurrency'] = 4  # Maximum number of embedding requests in flight
+config['emb_cache'] = 'outputs/embedding_cache'  # Persistent embedding cache folder (None = disabled)
+config['emb_memo_size'] = 128  # Number of question embeddings kept in memory (LRU)
 
 # RETRIEVER
 config['k_lim'] = 5  # Maximum number of examples to be extracted
 config['thresh'] = 0.6  # Minimum similarity threshold for schema filtering
+config['ann_lists'] = None  # Number of clusters of the ANN indexes (None = square root of the elements)
+config['ann_probes'] = 8  # Number of clusters scanned by each ANN search
+config['emb_storage'] = 'float32'  # Schema embeddings storage: 'float32', 'float16' or 'int8'
+config['rescore'] = 4  # Quantized storage: rescore k_lim * rescore candidates exactly (0 = disabled)
 
 aq_tuple = (  # RequiredAuto-Queries, with name, phase and (maybe) parameters
     ('LABELS', 'dense-thresh'),
-    ('NAMES', 'dense-klim'),
+    ('NAMES', 'dense-klim'),  # 'dense-klim/ivf' to use the approximate nearest-neighbour index
     ('OBJECT PROPERTIES', 'launch',
      None,  # initial schema : don't change this value
      3,  # i = maximum threshold, independent to k_lim
@@ -50,6 +68,13 @@ aq_tuple = (  # RequiredAuto-Queries, with name, phase and (maybe) parameters
     ('RELATIONSHIPS NAMES', 'dense-klim'),
 )
 config['aq_tuple'] = aq_tuple
+config['introspection'] = True  # Read labels, names and relationships with a single query at startup
+config['introspection_details'] = False  # Also read property keys, label membership and relationship patterns
+config['page_size'] = 0  # Read the names page by page, embedding them while they arrive (0 = disabled)
+config['create_pager_index'] = False  # Paged names: create the NamedIndividual(name) index if missing (schema write)
+config['aq_timeout'] = 120  # Seconds after which the server terminates an auto-query (None = server default)
+config['props_cache_size'] = 1024  # Cached property maps of the individuals (0 = disabled)
+config['props_cache_ttl'] = 600  # Seconds before a cached property map expires (None = never)
 
 # System labels (ignored in the auto-queries)
 sys_classes = ('_graphconfig', 'resource', 'ontology', 'objectproperty', 'datatypeproperty',)
@@ -61,6 +86,16 @@ sys_labels = sys_classes + sys_rel_types
 config['question_prompt'] = QP.instructions_prompt
 config['answer_prompt'] = AP.answer_prompt
 config['examples'] = EL.examples_list
+config['prompt_layout'] = 'schema-first'  # 'schema-first' or 'prefix-cache' (see LanguageModel.layouts)
+
+# QUESTION CACHE (manual sessions): reuse the validated query of a similar question
+config['question_cache'] = 'outputs/question_cache.json'  # Cache file (None = not persistent)
+config['question_cache_size'] = 256  # Maximum number of cached questions (0 = disabled)
+config['question_cache_thresh'] = 0.95  # Minimum similarity between two questions to reuse the query
+
+# GENERATION CONTROLS: think (True/False, None = model default), num_predict (max output tokens), stop sequences
+config['cypher_generation'] = {'think': False, 'num_predict': 256, 'stop': None}
+config['answer_generation'] = {'think': False, 'num_predict': 512, 'stop': None}
 
 # CHOOSE YOUR QUERIES
 config['test_queries'] = [
@@ -1,16 +1,27 @@
+import asyncio
+from collections import OrderedDict
+
 import ollama as ol
 import numpy as np
 
+from utilities.embedding_cache import EmbeddingCache
+
 
 class Embedder:
     """
     This is the Embedding model
     """
-    def __init__(self, embedder_name: str = None, client: ol.AsyncClient = None):
+    def __init__(self, embedder_name: str = None, client: ol.AsyncClient = None,
+                 batch_size: int = 64, max_concurrency: int = 4, cache_dir: str = None,
+                 memo_size: int = 128):
         """
         Initialize the Embedder class.
         :param embedder_name: The name of the embedding model to use (e.g., 'nomic-embed-text').
         :param client: An optional existing Ollama AsyncClient.
+        :param batch_size: number of texts sent in a single embed request
+        :param max_concurrency: maximum number of embed requests in flight at the same time
+        :param cache_dir: folder of the persistent embedding cache (None = no cache)
+        :param memo_size: maximum number of texts kept in the in-memory LRU memo (0 = disabled)
         """
         self.name = embedder_name
 
@@ -18,6 +29,19 @@ class Embedder:
             client = ol.AsyncClient("localhost")
         self.client = client
 
+        self.batch_size: int = max(1, batch_size)
+        self.max_concurrency: int = max(1, max_concurrency)
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)  # shared by all the concurrent calls
+
+        self.cache: EmbeddingCache | None = None
+        if cache_dir is not None:
+            self.cache = EmbeddingCache(cache_dir, embedder_name)
+
+        # LRU memo of the last embedded texts (i.e. the user questions)
+        self.memo: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.memo_size: int = max(0, memo_size)
+        self.memo_hits: int = 0
+        self.memo_misses: int = 0
 
     def check_installation(self):
         """
@@ -43,18 +67,92 @@ class Embedder:
         """
         Create the embedding of the given text
         """
-        response = await self.client.embeddings(model=self.name, prompt=text)
-        return np.array(response['embedding'])
+        if text in self.memo:
+            self.memo_hits += 1
+            self.memo.move_to_end(text)
+            return self.memo[text]
+        self.memo_misses += 1
+
+        embedding = None
+        if self.cache is not None:
+            embedding = self.cache.get(text)
+
+        if embedding is None:
+            response = await self.client.embeddings(model=self.name, prompt=text)
+            embedding = np.array(response['embedding'])
+            if self.cache is not None:
+                self.cache.put(text, embedding)
+
+        self.remember(text, embedding)
+        return embedding
+
+    def remember(self, text: str, embedding: np.ndarray) -> None:
+        """
+        Store an embedding in the LRU memo, evicting the least recently used one
+        """
+        if self.memo_size == 0:
+            return
+        self.memo[text] = embedding
+        self.memo.move_to_end(text)
+        while len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
+
+    def memo_info(self) -> dict:
+        """
+        Statistics of the LRU memo
+        """
+        return {
+            'hits': self.memo_hits,
+            'misses': self.memo_misses,
+            'size': len(self.memo),
+            'max_size': self.memo_size,
+        }
+
+    async def get_batch_embeddings(self, texts: list[str]) -> list[np.ndarray]:
+        """
+        Create the embeddings of a list of texts with the multi-input embed endpoint.
+        Texts are split in chunks of batch_size; at most max_concurrency chunks are in flight.
+        :param texts: the texts to be embedded
+        :return: the embeddings, in the same order of the texts
+        """
+        chunks = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+
+        async def embed_chunk(chunk: list[str]) -> list[np.ndarray]:
+            async with self.semaphore:
+                response = await self.client.embed(model=self.name, input=chunk)
+            return [np.array(embedding) for embedding in response['embeddings']]
+
+        results = await asyncio.gather(*(embed_chunk(chunk) for chunk in chunks))  # keeps the chunk order
+        return [embedding for chunk_result in results for embedding in chunk_result]
 
     async def get_list_embeddings(self, objects: list[str]) -> list[tuple[str, np.ndarray]]:
         """
-        Create an embedding for each element of a list
+        Create an embedding for each element of a list.
+        The new embeddings are written on the disk cache by save_cache(), not at each call
         """
-        output = []
-        for content in objects:
-            embedding = await self.get_embedding(content)
-            output.append((content, embedding))
-        return output
+        if self.cache is None:
+            embeddings = await self.get_batch_embeddings(objects)
+            return list(zip(objects, embeddings))
+
+        embeddings = [self.cache.get(content) for content in objects]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+
+        if missing:  # embed only the texts that aren't in the cache
+            new_embeddings = await self.get_batch_embeddings([objects[i] for i in missing])
+            for i, embedding in zip(missing, new_embeddings):
+                embeddings[i] = embedding
+                self.cache.put(objects[i], embedding)
+            if self.cache.pending_bytes >= self.cache.flush_bytes:  # bound the memory of the unsaved embeddings
+                self.cache.save()
+
+        return list(zip(objects, embeddings))
+
+    def save_cache(self) -> None:
+        """
+        Write the new embeddings on the persistent cache
+        """
+        if self.cache is not None:
+            self.cache.save()
 
     @staticmethod
     def cosine_similarity(vec1: np.ndarray, vec2: np.ndarray) -> float:
@@ -64,4 +162,179 @@ class Embedder:
         :param vec2: Second vector.
         :return: Cosine similarity score (-1 to 1).
         """
-        return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))  # type: ignore
\ No newline at end of file
+        return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))  # type: ignore
+
+class EmbeddingMatrix:
+    """
+    Embedded results of an auto-query: the contents and a contiguous matrix,
+    with one L2-normalized row for each content.
+    The rows can be stored as float32, float16 or int8 (scalar quantization with a scale for each row)
+    """
+    storages = ('float32', 'float16', 'int8')
+    block_size = 16384  # rows converted to float32 at a time, while scoring a quantized matrix
+
+    def __init__(self, contents: list, embeddings: list[np.ndarray] | np.ndarray, storage: str = 'float32'):
+        """
+        :param contents: the embedded objects
+        :param embeddings: their embeddings, in the same order
+        :param storage: storage type of the rows: 'float32', 'float16' or 'int8'
+        """
+        if storage not in self.storages:
+            raise ValueError(f'Storage {storage} not recognized: use one of {self.storages}')
+
+        self.contents: list = list(contents)
+        self.storage: str = storage
+        self.scales: np.ndarray | None = None  # int8 only: dequantization scale of each row
+
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if len(self.contents) == 0:
+            matrix = matrix.reshape(0, matrix.shape[-1] if matrix.ndim > 1 else 0)
+        matrix = self.normalize(matrix)
+
+        if storage == 'float16':
+            matrix = matrix.astype(np.float16)
+        elif storage == 'int8':
+            scales = np.abs(matrix).max(axis=1, initial=0) / 127
+            scales[scales == 0] = 1
+            matrix = np.round(matrix / scales[:, None]).astype(np.int8)
+            self.scales = scales.astype(np.float32)
+
+        self.matrix: np.ndarray = np.ascontiguousarray(matrix)
+
+    @classmethod
+    def from_pairs(cls, pairs: list[tuple], storage: str = 'float32') -> 'EmbeddingMatrix':
+        """
+        Build the matrix from a list of (content, embedding) pairs
+        """
+        return cls([pair[0] for pair in pairs], [pair[1] for pair in pairs], storage=storage)
+
+    @classmethod
+    def concat(cls, parts: list['EmbeddingMatrix'], storage: str = 'float32') -> 'EmbeddingMatrix':
+        """
+        Join some matrices with the same storage type (e.g. the pages of an auto-query)
+        """
+        parts = [part for part in parts if len(part) > 0]
+        if len(parts) == 1:
+            return parts[0]
+
+        joined = cls([], [], storage=storage)
+        if not parts:
+            return joined
+        joined.contents = [content for part in parts for content in part.contents]
+        joined.matrix = np.ascontiguousarray(np.concatenate([part.matrix for part in parts]))
+        if storage == 'int8':
+            joined.scales = np.concatenate([part.scales for part in parts])
+        return joined
+
+    def updated(self, kept_rows: list[int], pairs: list[tuple]) -> 'EmbeddingMatrix':
+        """
+        Build a new matrix with some rows of this one, plus new (content, embedding) pairs.
+        The kept rows are copied as they are, without normalizing or quantizing them again
+        :param kept_rows: indexes of the rows to keep
+        :param pairs: new elements, appended after the kept rows
+        """
+        added = EmbeddingMatrix.from_pairs(pairs, storage=self.storage)
+        kept_rows = np.asarray(kept_rows, dtype=np.int64)
+
+        merged = EmbeddingMatrix([], [], storage=self.storage)
+        merged.contents = [self.contents[row] for row in kept_rows] + added.contents
+        if len(added) == 0:
+            merged.matrix = np.ascontiguousarray(self.matrix[kept_rows])
+        elif len(kept_rows) == 0:
+            merged.matrix = added.matrix
+        else:
+            merged.matrix = np.ascontiguousarray(np.concatenate((self.matrix[kept_rows], added.matrix)))
+        if self.scales is not None:
+            merged.scales = np.concatenate((self.scales[kept_rows], added.scales))
+        return merged
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        """
+        L2-normalize a vector or the rows of a matrix (null vectors are left unchanged)
+        """
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    @property
+    def quantized(self) -> bool:
+        return self.storage != 'float32'
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory used by the embeddings
+        """
+        return self.matrix.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def vectors(self, rows: np.ndarray | slice = slice(None)) -> np.ndarray:
+        """
+        Get some rows as float32 vectors (dequantized, if needed)
+        """
+        vectors = self.matrix[rows].astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[rows][..., None]
+        return vectors
+
+    def __len__(self) -> int:
+        return len(self.contents)
+
+    def __iter__(self):
+        """
+        Iterate over (content, embedding) pairs, like the plain list of the embedder
+        """
+        for i, content in enumerate(self.contents):
+            yield content, self.vectors(i)
+
+    def __getitem__(self, index: int) -> tuple:
+        return self.contents[index], self.vectors(index)
+
+    def __repr__(self) -> str:
+        return f'EmbeddingMatrix({self.contents!r}, shape={self.matrix.shape}, storage={self.storage})'
+
+    def similarities(self, query_emb: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Cosine similarity of each row with the query embedding: a single matrix-vector product
+        (block by block, for a quantized matrix)
+        :param rows: compute only these rows (None = all the rows)
+        """
+        query = self.normalize(np.asarray(query_emb, dtype=np.float32))
+
+        if not self.quantized:
+            matrix = self.matrix if rows is None else self.matrix[rows]
+            return matrix @ query
+
+        if rows is None:
+            rows = np.arange(len(self))
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), self.block_size):
+            block = rows[start:start + self.block_size]
+            scores[start:start + self.block_size] = self.vectors(block) @ query
+        return scores
+
+    def top_k(self, query_emb: np.ndarray, k_lim: int = 10, thresh: float = 0.65,
+              rows: np.ndarray = None) -> list[int]:
+        """
+        Select the rows with a similarity greater than thresh, at most k_lim of them (0 = no limit)
+        :param rows: restrict the search to these row indexes (None = all the rows)
+        :return: the row indexes, by descending similarity
+        """
+        if len(self) == 0:
+            return []
+
+        if rows is None:
+            rows = np.arange(len(self))
+            scores = self.similarities(query_emb)
+        else:
+            rows = np.sort(np.asarray(rows, dtype=np.int64))
+            scores = self.similarities(query_emb, rows=rows)
+
+        candidates = np.flatnonzero(scores > thresh)
+
+        if 0 < k_lim < len(candidates):
+            best = np.argpartition(-scores[candidates], k_lim - 1)[:k_lim]
+            candidates = np.sort(candidates[best])
+
+        order = np.argsort(-scores[candidates], kind='stable')  # ties keep the original order
+        return rows[candidates[order]].tolist()
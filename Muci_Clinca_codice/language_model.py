@@ -1,5 +1,7 @@
 import asyncio
-from collections.abc import AsyncIterator
+import re
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
 import ollama as ol  # required under pip
 from aioconsole import aprint, ainput  # required under pip
 
@@ -51,21 +53,108 @@ async def user_input() -> str:
     return await ainput(user_symb)
 
 
+class CypherStreamParser:
+    """
+    Incremental parser of the Cypher stage stream: it recognizes when the query is complete,
+    so the generation can be stopped without waiting for the end of the stream.
+    A query is complete when:
+    - its ```cypher fence is closed
+    - outside a fence (and after the </think> block), the statement is followed by a blank line or a ';'
+    """
+    # opening fence: a Cypher language tag (even on the same line of the query) or any tag followed by a newline
+    fence = re.compile(r'```(?:(?i:cypher|cql|neo4j)\b[ \t]*\n?|[\w-]*[ \t]*\n)?(.*?)```', re.DOTALL)
+    statement_start = re.compile(r'^[ \t]*(MATCH|OPTIONAL MATCH|WITH|UNWIND|CALL|RETURN|CREATE|MERGE)\b', re.MULTILINE)
+    statement_end = re.compile(r'\b(RETURN|CREATE|MERGE|DELETE|SET|REMOVE)\b')  # final clauses of a statement
+
+    def __init__(self):
+        self.text: str = ''
+        self.query: str | None = None
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Add a chunk of the stream
+        :return: True if the query is complete
+        """
+        self.text += chunk
+        if self.query is None:
+            self.query = self.parse(self.text)
+        return self.query is not None
+
+    @classmethod
+    def parse(cls, text: str) -> str | None:
+        """
+        Extract the query from a partial response
+        :return: the query, or None if it's not complete yet
+        """
+        if '<think>' in text:
+            if '</think>' not in text:
+                return None  # still thinking
+            text = text.split('</think>', 1)[1]
+
+        if '```' in text:
+            match = cls.fence.search(text)
+            if match is None:
+                return None  # wait for the closing fence
+            return match.group(1).strip() or None
+
+        start = cls.statement_start.search(text)
+        if start is None:
+            return None
+        end = cls.statement_terminator(text, start.start())
+        if end is None:
+            return None
+        statement = text[start.start():end].strip()
+        return statement if cls.statement_end.search(statement) else None
+
+    @staticmethod
+    def statement_terminator(text: str, start: int) -> int | None:
+        """
+        Position of the first ';' or blank line after start, outside the string literals
+        """
+        quote = None
+        i = start
+        while i < len(text):
+            char = text[i]
+            if quote:
+                if char == '\\':
+                    i += 1  # skip the escaped character
+                elif char == quote:
+                    quote = None
+            elif char in '\'"`':
+                quote = char
+            elif char == ';' or text.startswith('\n\n', i):
+                return i
+            i += 1
+        return None
+
+
 class LanguageModel:  # B-ver.
     """
     The Language Model implementation
     """
     # from configuration.py
 
+    # Prompt layouts:
+    # - schema-first: the context (e.g. the filtered schema) is appended to the system prompt, before the examples
+    # - prefix-cache: system prompt and examples come first, context and question last; the stable prefix
+    #   is the same for every question, so Ollama can reuse its KV cache instead of evaluating it again
+    layouts = ('schema-first', 'prefix-cache')
+
     def __init__(self, model_name: str = None, sys_prompt: str = None,
                  examples: list[dict] = None,  # temperature: float = 0.0,
+                 layout: str = 'schema-first', generation: dict[str, dict] = None,
                  ) -> None:
         """
         Initialize the LLM Agent
         :args model_name: the name of the model
         :args sys_prompt: the system prompt
         :args examples: the examples passed to the model
+        :args layout: prompt layout, one of LanguageModel.layouts
+        :args generation: generation controls of each stage ('cypher', 'answer'):
+            think (True/False, None = model default), num_predict (maximum output tokens) and stop (stop sequences)
         """
+        if layout not in self.layouts:
+            raise ValueError(f'Unknown prompt layout: {layout}. Choose one of {self.layouts}')
 
         self.llm_cli = ol.AsyncClient("localhost")
         self.temperature: float = 0.0  # always set to 0.0
@@ -79,6 +168,12 @@ class LanguageModel:  # B-ver.
 
         self.examples_list = self.init_examples(examples=examples)
 
+        self.layout: str = layout
+        self.generation: dict[str, dict] = generation or {}
+        self.prompt_stats: dict = {}  # prompt evaluation of the last chat: tokens and milliseconds
+        self.cypher_stats: dict = {}  # generation time of the last query, and if the stream was stopped early
+        self.answer_stats: dict = {}  # time to first token and total time of the last streamed answer
+
     def check_installation(self) -> bool:
         """
         Check if the model is installed in Ollama
@@ -116,49 +211,104 @@ class LanguageModel:  # B-ver.
 
         return chat_history
 
-    async def launch_chat(self, query: str, prompt_upd: str = None) -> AsyncIterator[str]:
+    def build_messages(self, query: str, context: str = None) -> list[ol.Message]:
+        """
+        Arrange system prompt, examples, context and query according to the prompt layout
+        :param query: query (user question or answer context)
+        :param context: per-question context, e.g. the filtered schema
+        """
+        if not context:
+            system, question = self.sys_prompt, query
+        elif self.layout == 'prefix-cache':
+            system, question = self.sys_prompt, f'{context.strip()}\n\nUser question: {query}'
+        else:  # schema-first
+            system, question = self.sys_prompt + context, query
+
+        return [ol.Message(role="system", content=system)] + \
+            self.examples_list + [
+            ol.Message(role="user", content=question),
+        ]
+
+    def stage_options(self, stage: str = None) -> tuple[bool | None, dict]:
+        """
+        Thinking mode and Ollama options of a generation stage
+        :param stage: 'cypher', 'answer' or None (no controls)
+        :return: think flag and options
+        """
+        controls = self.generation.get(stage, {})
+        options = {'temperature': self.temperature}
+        if controls.get('num_predict') is not None:
+            options['num_predict'] = controls['num_predict']
+        if controls.get('stop'):
+            options['stop'] = list(controls['stop'])
+        return controls.get('think'), options
+
+    async def launch_chat(self, query: str, prompt_upd: str = None, context: str = None,
+                          stage: str = None) -> AsyncIterator[str]:
         """
         Launch a chat exchange with the LLM
         :param query: query (user question or answer context)
         :param prompt_upd: change the system prompt
+        :param context: per-question context, placed according to the prompt layout
+        :param stage: generation stage, whose controls are applied ('cypher', 'answer')
         """
         if prompt_upd is not None:  # system prompt update
             self.sys_prompt = prompt_upd
 
-        messages = [ol.Message(role="system", content=self.sys_prompt)] + \
-                   self.examples_list + [
-            ol.Message(role="user", content=query),
-        ]
+        messages = self.build_messages(query, context)
+        think, options = self.stage_options(stage)
+        self.prompt_stats = {}  # set by the last chunk: missing if the stream is closed earlier
 
+        response = None
         try:  # Launch the chat
             response: AsyncIterator[ol.ChatResponse] = await self.llm_cli.chat(
                 self.model_name, messages,
                 stream=True,
-                options={'temperature': self.temperature}
+                think=think,
+                options=options,
             )
             async for chunk in response:
+                if chunk.done:
+                    self.prompt_stats = {
+                        'prompt_tokens': chunk.prompt_eval_count or 0,  # cached prefix tokens are not counted
+                        'prompt_eval_ms': (chunk.prompt_eval_duration or 0) / 1e6,
+                    }
                 yield chunk.message.content
 
         except Exception as err:
             await aprint(agent_sym + f"LLM streaming error: {err}")
             yield ""
 
-    async def write_cypher_query(self, question: str, prompt_upd: str = None):
+        finally:
+            if response is not None:
+                await response.aclose()  # closing the stream stops the generation on the Ollama server
+
+    async def write_cypher_query(self, question: str, prompt_upd: str = None, context: str = None):
         """
         Write the Cypher query and return it as a string, without directly printing it.
         :param question: initial user question
         :param prompt_upd: change the system prompt
+        :param context: the filtered schema, placed according to the prompt layout
         :return: the plain-text Cypher query
         """
-        stream_list = []
-        iterator:AsyncIterator[str] = self.launch_chat(query=question, prompt_upd=prompt_upd)
+        parser = CypherStreamParser()
+        start = time.perf_counter()
+        iterator:AsyncIterator[str] = self.launch_chat(
+            query=question, prompt_upd=prompt_upd, context=context, stage='cypher'
+        )
 
         try:
-            async for stream_chunk in iterator:
-                stream_list.append(stream_chunk)
-
-            cypher_query = "".join(stream_list).strip()  # : Literal_String
-            return self.complete_response(cypher_query)
+            try:
+                async for stream_chunk in iterator:
+                    if parser.feed(stream_chunk):
+                        break  # the query is complete: stop the generation
+            finally:
+                await iterator.aclose()
+
+            early_stop = parser.query is not None
+            cypher_query = parser.query if early_stop else self.complete_response(parser.text.strip())
+            self.cypher_stats = {'seconds': round(time.perf_counter() - start, 3), 'early_stop': early_stop}
+            return cypher_query
 
         except Exception as err:
             await aprint(agent_sym + f"Error while writing query: {err}")
@@ -177,7 +327,7 @@ class LanguageModel:  # B-ver.
             return final.strip()
         elif '```cypher' in response:
             _, partial = response.split('```cypher', 1)
-            final, _ = partial.split('```', 1)
+            final = partial.split('```', 1)[0]  # the fence may be still open if the generation was cut
             return final.strip()
         else:
             return response.strip()  # no split
@@ -189,7 +339,7 @@ class LanguageModel:  # B-ver.
         :param ans_context: the Neo4j outputs, in Cypher format
         :return: the natural language answer with the outputs explanation
         """
-        iterator: AsyncIterator[str] = self.launch_chat(query=ans_context, prompt_upd=answer_pmt)
+        iterator: AsyncIterator[str] = self.launch_chat(query=ans_context, prompt_upd=answer_pmt, stage='answer')
         stream_list = []
         try:
             async for chunk in iterator:
@@ -201,6 +351,55 @@ class LanguageModel:  # B-ver.
             await aprint(agent_sym + f"LLM full response error: {err}")
             return ""
 
+    async def stream_final_answer(self, answer_pmt: str, ans_context: str, symbol: str = agent_sym,
+                                  on_first_token: Callable[[], Awaitable] = None) -> str:
+        """
+        Write the final answer, printing its tokens in the terminal as they arrive.
+        A <think> paragraph is not printed.
+        :param answer_pmt: the LLM prompt
+        :param ans_context: the Neo4j outputs, in Cypher format
+        :param symbol: printed before the first token
+        :param on_first_token: awaited before printing the first token (e.g. to stop a spinner)
+        :return: the complete answer, as returned by write_final_answer
+        """
+        iterator: AsyncIterator[str] = self.launch_chat(query=ans_context, prompt_upd=answer_pmt, stage='answer')
+        stream_list = []
+        printed = 0  # characters of the visible text already printed
+        start = time.perf_counter()
+        first_token = None
+        self.answer_stats = {}
+        try:
+            async for chunk in iterator:
+                stream_list.append(chunk)
+                text = "".join(stream_list).lstrip()
+                if text.startswith('<think>'):
+                    if '</think>' not in text:
+                        continue  # still thinking
+                    text = text.split('</think>', 1)[1].lstrip()
+                elif '<think>'.startswith(text):
+                    continue  # it could be the beginning of <think>
+
+                if len(text) > printed:
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                        if on_first_token is not None:
+                            await on_first_token()
+                        await aprint(symbol, end='')
+                    await aprint(text[printed:], end='', flush=True)
+                    printed = len(text)
+
+            if first_token is not None:
+                await aprint()
+            self.answer_stats = {
+                'first_token_s': round(first_token, 3) if first_token is not None else None,
+                'total_s': round(time.perf_counter() - start, 3),
+            }
+            return self.complete_response("".join(stream_list).strip())
+
+        except Exception as err:
+            await aprint(agent_sym + f"LLM full response error: {err}")
+            return ""
+
 
 if __name__ == "__main__":
     pass
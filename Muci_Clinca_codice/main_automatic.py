@@ -7,6 +7,7 @@ import datetime
 from language_model import *
 from embedding_model import Embedder
 from retriever import DataRetriever
+from auto_queries import AQ
 from language_model import LanguageModel
 from neo4j_client import Neo4jClient
 
@@ -33,7 +34,15 @@ async def test_query(neo4j_pwd: str = config['n4j_psw'],
 
     client = Neo4jClient(user=config['n4j_usr'],
                          password=config['n4j_psw'],
-                         uri=config['n4j_url'])
+                         uri=config['n4j_url'],
+                         cache_size=config['n4j_cache_size'],
+                         cache_bytes=config['n4j_cache_bytes'],
+                         fetch_size=config['n4j_fetch_size'],
+                         max_rows=config['n4j_max_rows'],
+                         max_estimated_rows=config['n4j_max_estimated_rows'],
+                         max_hops=config['n4j_max_hops'],
+                         query_timeout=config['n4j_timeout'],
+                         parameterize=config['n4j_parameterize'])
     try:  # check if Neo4j is on
         await client.check_session()
     except Exception:
@@ -45,14 +54,22 @@ async def test_query(neo4j_pwd: str = config['n4j_psw'],
     llm_agent = LanguageModel(
         model_name=llm_name,
         examples=config['examples'],
+        layout=config['prompt_layout'],
+        generation={'cypher': config['cypher_generation'], 'answer': config['answer_generation']},
     )
-    embedder = Embedder(emb_name)
+    embedder = Embedder(emb_name,
+                        batch_size=config['emb_batch_size'],
+                        max_concurrency=config['emb_concurrency'],
+                        cache_dir=config['emb_cache'],
+                        memo_size=config['emb_memo_size'])
 
     retriever = DataRetriever(
         n4j_cli=client,
         embedder=embedder,
         k_lim=config['k_lim'],
         thresh=config['thresh'],
+        storage=config['emb_storage'],
+        rescore=config['rescore'],
     )
     await retriever.init_full_schema()
 
@@ -63,10 +80,13 @@ async def test_query(neo4j_pwd: str = config['n4j_psw'],
         print(f"Embedder used: {emb_name}", file=outfile)
         print(f'Filter limit: K = {config['k_lim']}', file=outfile)
         print(f'Threshold: {config['thresh']}', file=outfile)
+        print(f'Embeddings storage: {config["emb_storage"]} (rescore: {config["rescore"]})', file=outfile)
 
         print('\nAuto-queries:', file=outfile)
         for auto_query in config['aq_tuple']:
             print(f'\t{auto_query}', file=outfile)
+        for aq_name, recall in retriever.index_recall.items():
+            print(f'\tANN index on {aq_name}: recall@{config["k_lim"]} = {recall:.3f}', file=outfile)
 
         print('\nExamples:', file=outfile)
         for example_dict in config['examples']:
@@ -89,7 +109,7 @@ async def test_query(neo4j_pwd: str = config['n4j_psw'],
     with open(INPUT_FILE, 'r', encoding='utf-8') as f:
         test_queries = json.load(f)
         if not isinstance(test_queries, list):
-            await client.close()
+            await retriever.close()
             raise ValueError(f"Error: {INPUT_FILE} is not a list")
 
     testing_queries: list = []
@@ -118,18 +138,25 @@ async def test_query(neo4j_pwd: str = config['n4j_psw'],
             spinner.start(agent_sym + 'Filtering the Schema')
             retriever.reset_filter()
             await retriever.filter_schema(question=user_question)
-            question_pmt = instructions_pmt + retriever.transcribe_schema(filtered=True)
+            schema = retriever.transcribe_schema(filtered=True)
 
             await spinner.restart(agent_sym + 'Formulating the Query')
             cypher_query: str = await llm_agent.write_cypher_query(
-                question=user_question, prompt_upd=question_pmt
+                question=user_question, prompt_upd=instructions_pmt, context=schema
             )
 
             await spinner.stop()
             await aprint(query_sym, cypher_query)
 
             spinner.start('Processing Results')
-            query_results = await client.launch_db_query(cypher_query)
+            rejection = None
+            db_query, db_params = client.prepare_query(cypher_query)
+            if config['n4j_preflight']:
+                db_query, rejection = await client.preflight_query(db_query, db_params)
+            if rejection:
+                query_results = [{'rejected': rejection}]
+            else:
+                query_results = await client.launch_db_query(db_query, db_params)
             ans_context: str = (# NO print
                 f"Answer the user question by describing the outputs provided by Neo4j: \n"
                 f"Original user question: \"{user_question}\"\n"
@@ -148,6 +175,7 @@ async def test_query(neo4j_pwd: str = config['n4j_psw'],
                 print(f'\nFiltered Schema:\n{retriever.transcribe_schema()}\n\n', file=outfile)
                 print(f'\nUser Query:\n{user_question} (ID: {tq})', file=outfile)
                 print(f'\nGenerated Cypher query:\n{cypher_query}', file=outfile)
+                print(f'Query generation: {llm_agent.cypher_stats}', file=outfile)
                 print(f'\nNeo4j outputs:\n{query_results}', file=outfile)
                 print(f'\nGenerated Answer:\n{answer}', file=outfile)
                 print(f'\nExpected answer:\n{expected_ans}', file=outfile)
@@ -158,13 +186,18 @@ async def test_query(neo4j_pwd: str = config['n4j_psw'],
 
         except asyncio.CancelledError:
             await spinner.stop()
-            await client.close()
+            await retriever.close()
             await aprint("Test Interrupted!")
             return
 
-    await client.close()
+    await retriever.close()
 
     with open('./outputs/automatic_results.txt', 'a') as outfile:
+        print(f'\nEmbedding memo: {embedder.memo_info()}', file=outfile)
+        print(f'Auto-queries repeated texts (estimated): {AQ.text_stats.report()}', file=outfile)
+        print(f'Generated queries repeated texts (estimated): {client.text_stats.report()}', file=outfile)
+        print(f'Property maps cache: {AQ.properties_cache.info()}', file=outfile)
+        print(f'Query results cache: {client.results_cache.info()}', file=outfile)
         print(f'\nTest concluded: {datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")}', file=outfile)
     print(f'\n# Test concluded: {datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")}')
 
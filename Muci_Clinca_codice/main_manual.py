@@ -5,6 +5,7 @@ from neo4j.exceptions import Neo4jError
 
 from embedding_model import Embedder
 from retriever import DataRetriever
+from utilities.question_cache import QuestionCache
 from utilities.spinner import Spinner
 from configuration import config
 
@@ -29,7 +30,15 @@ async def main(save_prompts: bool = True) -> None:
     try:  # check if Neo4j is on
         n4j_client = Neo4jClient(user=config['n4j_usr'],
                                  password=config['n4j_psw'],
-                                 uri=config['n4j_url'])
+                                 uri=config['n4j_url'],
+                                 cache_size=config['n4j_cache_size'],
+                                 cache_bytes=config['n4j_cache_bytes'],
+                                 fetch_size=config['n4j_fetch_size'],
+                                 max_rows=config['n4j_max_rows'],
+                                 max_estimated_rows=config['n4j_max_estimated_rows'],
+                                 max_hops=config['n4j_max_hops'],
+                                 query_timeout=config['n4j_timeout'],
+                                 parameterize=config['n4j_parameterize'])
         await n4j_client.check_session()
     except Exception:
         return
@@ -40,15 +49,22 @@ async def main(save_prompts: bool = True) -> None:
 
     # LARGE LANGUAGE MODEL
     exit_commands = config['quit_key_words']
+    refresh_commands = config['refresh_key_words']
 
     # Checking the installation of models
     llm_agent = LanguageModel(
         model_name=config['llm'],
         examples=config['examples'],
+        layout=config['prompt_layout'],
+        generation={'cypher': config['cypher_generation'], 'answer': config['answer_generation']},
     )  # LLM creation
 
     # EMBEDDING MODEL
-    embedder = Embedder(config['embedder'])
+    embedder = Embedder(config['embedder'],
+                        batch_size=config['emb_batch_size'],
+                        max_concurrency=config['emb_concurrency'],
+                        cache_dir=config['emb_cache'],
+                        memo_size=config['emb_memo_size'])
 
     # Check models installation
     if not llm_agent.check_installation() or not embedder.check_installation():
@@ -60,9 +76,16 @@ async def main(save_prompts: bool = True) -> None:
     retriever = DataRetriever(
         n4j_cli=n4j_client, embedder=embedder,
         k_lim=config['k_lim'], thresh=config['thresh'],
+        storage=config['emb_storage'], rescore=config['rescore'],
     )
     await retriever.init_full_schema()
 
+    # QUESTION CACHE: validated queries of the previous questions
+    question_cache = QuestionCache(embedder, path=config['question_cache'],
+                                   max_size=config['question_cache_size'],
+                                   threshold=config['question_cache_thresh'])
+    await question_cache.load(schema=retriever.schema_fingerprint())
+
     # PROMPT PRINTING
     with open(OUTPUT_PATH, 'w') as pmt_file:
         print('\n### CONFIGURATION DATA ###', file=pmt_file)
@@ -103,19 +126,37 @@ async def main(save_prompts: bool = True) -> None:
                 await asyprint(agent_sym, "You've type an exit command: bye bye")
                 break
 
+            # Read the schema again (e.g. the graph has changed): the cached queries may be outdated
+            if user_question.lower() in refresh_commands:
+                spinner.start(agent_sym + "Reading the schema again")
+                changes = await retriever.refresh_full_schema()
+                question_cache.set_schema(retriever.schema_fingerprint())
+                await spinner.stop()
+                await asyprint(agent_sym, f"Schema updated (added, removed): {changes}")
+                continue
+
             # Start querying the database
             spinner.start(agent_sym + "Formulating the query. It can take a while")
 
-            # Filtering phase
-            retriever.reset_filter()
+            # Question cache: a similar question may already have a validated query
+            names = await retriever.filter_names(user_question) if len(question_cache) else set()
+            cypher_query: str | None = await question_cache.lookup(user_question, names=names)
+            cached: bool = cypher_query is not None
 
-            await retriever.filter_schema(question=user_question)
-            question_pmt = instructions_pmt + retriever.transcribe_schema(filtered=True)
+            if cached:
+                question_pmt = '(query reused from the question cache)'
+            else:
+                # Filtering phase
+                retriever.reset_filter()
 
-            # Query generation phase
-            cypher_query: str = await llm_agent.write_cypher_query(
-                question=user_question, prompt_upd=question_pmt
-            )
+                await retriever.filter_schema(question=user_question)
+                schema = retriever.transcribe_schema(filtered=True)
+                question_pmt = instructions_pmt + schema
+
+                # Query generation phase
+                cypher_query = await llm_agent.write_cypher_query(
+                    question=user_question, prompt_upd=instructions_pmt, context=schema
+                )
 
             # Saving Prompts
             if save_prompts:
@@ -134,8 +175,17 @@ async def main(save_prompts: bool = True) -> None:
 
             # NEO4J OPERATIONS #
             try:
-                query_results = await n4j_client.launch_db_query(cypher_query)  # pass the query to the Neo4j client
+                db_query, db_params = n4j_client.prepare_query(cypher_query)
+                if config['n4j_preflight']:
+                    db_query, rejection = await n4j_client.preflight_query(db_query, db_params)
+                    if rejection:
+                        await asyprint(neo4j_sym, f"Query rejected: {rejection}\n")
+                        continue  # -> next user question
+
+                query_results = await n4j_client.launch_db_query(db_query, db_params)  # pass the query to the client
                 await aprint(neo4j_sym, f"{query_results}")  # print the Cypher answer
+                if query_results and not cached:  # the query works: reuse it for similar questions
+                    await question_cache.put(user_question, cypher_query)
 
             except Neo4jError as err:
                 await spinner.stop()
@@ -152,7 +202,13 @@ async def main(save_prompts: bool = True) -> None:
                 f"Result from Neo4j: {query_results}"
             )
 
-            answer: str = await llm_agent.write_final_answer(answer_pmt=answer_pmt, ans_context=ans_context)
+            # the answer is printed while it's generated
+            answer: str = await llm_agent.stream_final_answer(
+                answer_pmt=answer_pmt, ans_context=ans_context, on_first_token=spinner.stop
+            )
+            await spinner.stop()  # in case of an empty answer
+            await aprint(f"(first token after {llm_agent.answer_stats.get('first_token_s')} s, "
+                         f"answer completed in {llm_agent.answer_stats.get('total_s')} s)")
 
             if save_prompts:
                 with open(OUTPUT_PATH, 'a') as pmt_file:
@@ -160,14 +216,13 @@ async def main(save_prompts: bool = True) -> None:
                     print('\n### CONTEXT ###\n', file=pmt_file)
                     print(ans_context, file=pmt_file)
                     print(f"\nGENERATED QUERY: {cypher_query}", file=pmt_file)
+                    print(f"QUERY GENERATION: {llm_agent.cypher_stats}", file=pmt_file)
                     print('\n### ANSWER ###\n', file=pmt_file)
                     print(answer, file=pmt_file)
+                    print(f"\nANSWER STREAMING: {llm_agent.answer_stats}", file=pmt_file)
 
                     print('\n' + 25 * '#' + '\n', file=pmt_file)
 
-            await spinner.stop()
-            await asyprint(agent_sym, answer)
-
             print()  # new line
         # END while
 
@@ -181,7 +236,13 @@ async def main(save_prompts: bool = True) -> None:
         await asyprint(agent_sym, f"An error occurred in the main loop: {err}")
 
     finally:  # Normal conclusion
-        await n4j_client.close()
+        await retriever.close()
+        question_cache.save()
+        if save_prompts:
+            with open(OUTPUT_PATH, 'a') as pmt_file:
+                print(f'\nGenerated queries repeated texts (estimated): {n4j_client.text_stats.report()}',
+                      file=pmt_file)
+                print(f'Question cache: {question_cache.info()}', file=pmt_file)
 
 
 if __name__ == "__main__":
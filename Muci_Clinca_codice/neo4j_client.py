@@ -1,19 +1,116 @@
+import asyncio
+import json
+import re
+import uuid
+from collections import OrderedDict, defaultdict
+from collections.abc import AsyncIterator
+
 from aioconsole import aprint
-from neo4j import AsyncDriver, AsyncGraphDatabase
-from neo4j.exceptions import AuthError, ServiceUnavailable, CypherSyntaxError
+from neo4j import AsyncDriver, AsyncGraphDatabase, Query, ResultSummary
+from neo4j.exceptions import AuthError, ClientError, CypherSyntaxError, Neo4jError, ServiceUnavailable
 
 from language_model import error_sym
+from utilities.cypher_literals import extract_literals
+from utilities.lru_cache import LRUCache
+
+# Queries that must always reach the server: writes, procedures and non-deterministic functions
+UNCACHEABLE_QUERY = re.compile(
+    r'\b(CREATE|MERGE|DELETE|SET|REMOVE|DROP|CALL|LOAD\s+CSV|FOREACH)\b'
+    r'|\b(rand|randomUUID|timestamp|datetime|date|time|localdatetime|localtime)\s*\(',
+    re.IGNORECASE
+)
+
+TRUNCATION_KEY = 'truncated'  # key of the marker added to the results that exceed the rows limit
+
+# Variable-length relationships without an upper bound: [*], [:REL*], [*2..]
+UNBOUNDED_PATH = re.compile(r'(\[[^\[\]]*\*\s*)(?:(\d+)\s*\.\.\s*|\.\.\s*)?\]')
+
+
+class QueryTextStats:
+    """
+    Repeated query texts, read from the result summaries.
+    Neo4j caches the execution plans by query text: a text already run (and not evicted from a client-side replay
+    of the server LRU cache) could reuse its plan. It's an estimate, not a server measurement: the server cache is
+    shared with the other clients, and a plan may be replanned anyway (e.g. when the statistics change).
+    """
+
+    def __init__(self, cache_size: int = 1000):
+        """
+        :param cache_size: size of the server query cache (server.db.query_cache_size)
+        """
+        self.cache_size: int = cache_size
+        self.planned: OrderedDict[str, None] = OrderedDict()  # query texts supposed in the server cache (LRU)
+        self.stats: dict[str, dict] = defaultdict(lambda: {'runs': 0, 'repeated': 0, 'available_after': 0})
+
+    def record(self, name: str, summary: ResultSummary) -> None:
+        """
+        Record the execution of a query
+        :param name: name of the query (e.g. the auto-query)
+        :param summary: result summary returned by Neo4j
+        """
+        text = summary.query
+        stats = self.stats[name]
+        stats['runs'] += 1
+        stats['available_after'] += summary.result_available_after or 0  # ms, planning included
+
+        if text in self.planned:
+            stats['repeated'] += 1
+            self.planned.move_to_end(text)
+        else:
+            self.planned[text] = None
+            if len(self.planned) > self.cache_size:
+                self.planned.popitem(last=False)
+
+    def report(self) -> dict[str, dict]:
+        """
+        Estimated rate of repeated query texts and average time to the first record of each query
+        """
+        return {
+            name: {
+                'runs': stats['runs'],
+                'repeated_text_rate': round(stats['repeated'] / stats['runs'], 3),  # estimated
+                'avg_available_after_ms': round(stats['available_after'] / stats['runs'], 1),
+            }
+            for name, stats in self.stats.items()
+        }
 
 
 class Neo4jClient:
     """Client for the Neo4j server"""
 
-    def __init__(self, uri: str = None, user: str = None, password: str = None) -> None:
+    # Last committed transaction id of the current database
+    tx_id_query = """
+        CALL dbms.queryJmx('org.neo4j:*') YIELD name, attributes
+        WHERE name CONTAINS 'name=Transactions' AND name CONTAINS 'database=' + $database
+        RETURN attributes.LastCommittedTxId.value AS tx_id
+        """
+
+    # Running transactions launched with a given tag in their metadata
+    tagged_tx_query = """
+        SHOW TRANSACTIONS YIELD transactionId, metaData
+        WHERE metaData.tag = $tag
+        RETURN transactionId
+        """
+
+    def __init__(self, uri: str = None, user: str = None, password: str = None,
+                 cache_size: int = 0, cache_bytes: int = 16_000_000, database: str = 'neo4j',
+                 fetch_size: int = 100, max_rows: int = None,
+                 max_estimated_rows: int = 1_000_000, max_hops: int = 5,
+                 query_timeout: float = None, parameterize: bool = False) -> None:
         """
         Neo4jClient constructor
         :param uri: Neo4j server URI
         :param user: Neo4j user name
         :param password: Neo4j password
+        :param cache_size: maximum number of cached query results (0 = no cache)
+        :param cache_bytes: byte budget of the cached results
+        :param database: database name, used to read its last committed transaction id
+        :param fetch_size: number of records fetched from the server at a time
+        :param max_rows: maximum number of records returned by launch_db_query (None = no limit)
+        :param max_estimated_rows: pre-flight cost budget: maximum rows estimated by the planner for any operator
+        :param max_hops: pre-flight upper bound given to the unbounded variable-length relationships
+        :param query_timeout: seconds after which the server terminates a generated query (None = server default)
+        :param parameterize: lift the literals of the queries into parameters, so that similar queries share a plan
         """
         if uri is None:
             uri = "bolt://localhost:7687"
@@ -25,24 +122,221 @@ class Neo4jClient:
 
         self.driver: AsyncDriver = AsyncGraphDatabase.driver(uri, auth=(user, password))
 
+        # Results cache: it's emptied when the database commits a new transaction
+        self.database: str = database
+        self.results_cache = LRUCache(max_size=cache_size, max_bytes=cache_bytes)
+        self.cache_tx_id = None  # transaction id of the cached results
+
+        self.fetch_size: int = fetch_size
+        self.max_rows: int | None = max_rows
+
+        self.max_estimated_rows: int = max_estimated_rows
+        self.max_hops: int = max_hops
+
+        self.query_timeout: float | None = query_timeout
+
+        self.parameterize: bool = parameterize
+        self.text_stats = QueryTextStats()  # repeated texts of the queries run by launch_db_query
+
     async def close(self) -> None:
         await self.driver.close()
 
+    def prepare_query(self, query: str, params: dict | None = None) -> tuple[str, dict]:
+        """
+        Prepare a generated query: with parameterize, its literals are lifted into parameters.
+        Pre-flight and execution must receive the same prepared pair, so they plan the same text
+        :param query: Neo4j query
+        :param params: Neo4j query parameters
+        :return: the query to run and its parameters
+        """
+        params = params or {}
+        if not self.parameterize:
+            return query, params
+        query, literals = extract_literals(query, reserved=set(params))
+        return query, {**params, **literals}
+
     async def launch_db_query(self, query: str, params: dict | None = None) -> list[dict]:
         """
         Launches a query to the Neo4j database
-        :param query: Neo4j query
+        :param query: Neo4j query (already prepared by prepare_query)
         :param params: Neo4j query parameters
         """
         params = params or {}
+        cache_key = await self.cache_key(query, params)
+        if cache_key is not None:
+            cached = self.results_cache.get(cache_key)
+            if cached is not None:
+                return list(cached)
+
         try:
-            async with self.driver.session() as session:
-                # query = LiteralString(query)
-                result = await session.run(query, params)  # type: ignore
-                return [record.data() async for record in result]  # query outputs
+            results = [record async for record in self.stream_db_query(query, params, max_rows=self.max_rows)]
         except CypherSyntaxError:
             await aprint(error_sym, f"Cypher Syntax Error")
             return []
+        except ClientError as err:
+            if 'TransactionTimedOut' not in (err.code or ''):
+                raise
+            await aprint(error_sym, f"Query terminated after {self.query_timeout} seconds")
+            return []
+
+        if cache_key is not None:
+            size = len(json.dumps(results, default=str))  # approximate size in bytes
+            self.results_cache.put(cache_key, results, size=size)
+        return list(results)
+
+    async def stream_db_query(self, query: str, params: dict | None = None,
+                              max_rows: int = None) -> AsyncIterator[dict]:
+        """
+        Launch a query and yield its records one by one, fetching them from the server in batches of fetch_size.
+        If there are more than max_rows records, the remaining ones are discarded on the server
+        and a final marker {TRUNCATION_KEY: message} is yielded.
+        The transaction has the query_timeout; if the task is cancelled, the transaction is terminated on the server
+        :param query: Neo4j query
+        :param params: Neo4j query parameters
+        :param max_rows: maximum number of records (None = no limit)
+        """
+        tag = uuid.uuid4().hex  # identifies the transaction on the server
+        try:
+            async with self.driver.session(fetch_size=self.fetch_size) as session:
+                # query = LiteralString(query)
+                tagged_query = Query(query, metadata={'tag': tag}, timeout=self.query_timeout)  # type: ignore
+                result = await session.run(tagged_query, params or {})
+                count = 0
+                async for record in result:
+                    if max_rows is not None and count == max_rows:
+                        # stop the query: discard the remaining records
+                        self.text_stats.record('generated', await result.consume())
+                        yield {TRUNCATION_KEY: f'only the first {max_rows} results are shown'}
+                        return
+                    yield record.data()
+                    count += 1
+                self.text_stats.record('generated', await result.consume())
+        except asyncio.CancelledError:
+            await asyncio.shield(self.terminate_transactions(tag))
+            raise
+
+    async def terminate_transactions(self, tag: str) -> None:
+        """
+        Terminate on the server the transactions launched with the given tag.
+        The driver closes the connection of a cancelled query, but the server only notices it later:
+        in the meantime, the query would keep a database worker busy
+        """
+        try:
+            async with self.driver.session() as session:
+                result = await session.run(self.tagged_tx_query, tag=tag)
+                tx_ids = [record['transactionId'] async for record in result]
+                if tx_ids:
+                    await (await session.run('TERMINATE TRANSACTIONS $tx_ids', tx_ids=tx_ids)).consume()
+        except Neo4jError:
+            pass  # e.g. missing privileges: the server will terminate the transaction when it notices the lost connection
+
+    async def explain_query(self, query: str, params: dict | None = None) -> dict:
+        """
+        Get the execution plan of a query with EXPLAIN: the query is planned, not executed
+        :return: the plan, as a tree of operators
+        """
+        async with self.driver.session() as session:
+            explain_query = Query('EXPLAIN ' + query, timeout=self.query_timeout)  # type: ignore
+            result = await session.run(explain_query, params or {})
+            summary = await result.consume()
+            return summary.plan or {}
+
+    @staticmethod
+    def plan_operators(plan: dict) -> list[tuple[str, float]]:
+        """
+        List the (operator, estimated rows) pairs of a plan tree
+        """
+        operators = []
+        stack = [plan]
+        while stack:
+            operator = stack.pop()
+            if not operator:
+                continue
+            estimated = operator.get('args', {}).get('EstimatedRows', 0)
+            operators.append((operator.get('operatorType', ''), float(estimated)))
+            stack.extend(operator.get('children', []))
+        return operators
+
+    def bound_paths(self, query: str) -> str:
+        """
+        Give the upper bound max_hops to the unbounded variable-length relationships
+        """
+        def bound(match: re.Match) -> str:
+            lower = match.group(2) or ''
+            upper = max(int(lower or 0), self.max_hops)
+            return f'{match.group(1)}{lower}..{upper}]'
+
+        return UNBOUNDED_PATH.sub(bound, query)
+
+    async def preflight_query(self, query: str, params: dict | None = None) -> tuple[str, str | None]:
+        """
+        Pre-flight check of a generated query, before its execution:
+        - unbounded variable-length relationships are rewritten with max_hops as upper bound
+        - EXPLAIN catches the syntax errors without executing the query
+        - queries with an operator over the estimated rows budget (e.g. a large cartesian product) are rejected
+        :return: the query to execute (maybe rewritten) and the rejection reason (None if accepted)
+        """
+        if query.lstrip().upper().startswith(('EXPLAIN', 'PROFILE')):
+            return query, None
+
+        query = self.bound_paths(query)
+        try:
+            plan = await self.explain_query(query, params)
+        except CypherSyntaxError as err:
+            return query, f'Cypher Syntax Error: {err.message}'
+
+        operators = self.plan_operators(plan)
+        if not operators:
+            return query, None
+
+        operator, estimated = max(operators, key=lambda op: op[1])
+        if estimated > self.max_estimated_rows:
+            return query, (f'Query too expensive: {operator} estimates {estimated:.0f} rows '
+                           f'(budget: {self.max_estimated_rows})')
+        return query, None
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """
+        Normalize the query text: collapse the whitespaces and drop the final semicolon
+        """
+        return ' '.join(query.split()).rstrip(';').strip()
+
+    async def cache_key(self, query: str, params: dict) -> tuple | None:
+        """
+        Get the cache key of a query, after checking that the cached results are still valid
+        :return: the key, or None if the query must not be cached
+        """
+        if self.results_cache.max_size == 0 or UNCACHEABLE_QUERY.search(query):
+            return None
+
+        tx_id = await self.last_tx_id()
+        if tx_id is None:
+            return None  # can't tell if the database has changed
+        if tx_id != self.cache_tx_id:
+            self.results_cache.invalidate()  # new commits: the cached results may be stale
+            self.cache_tx_id = tx_id
+
+        return self.normalize_query(query), json.dumps(params, sort_keys=True, default=str)
+
+    async def last_tx_id(self) -> int | None:
+        """
+        Read the last committed transaction id of the database
+        :return: the transaction id, or None if it's not available (the cache is then disabled)
+        """
+        try:
+            async with self.driver.session() as session:
+                result = await session.run(self.tx_id_query, database=self.database)
+                record = await result.single()
+        except Exception as err:
+            record, reason = None, err
+        else:
+            reason = 'no transactions bean for this database'
+        if record is None or record['tx_id'] is None:
+            await aprint(error_sym, f"Results cache disabled: can't read the last transaction id ({reason})")
+            self.results_cache.max_size = 0  # don't pay this round trip again
+            return None
+        return record['tx_id']
 
     async def check_session(self) -> None:
         """
@@ -1,12 +1,22 @@
+import asyncio
 from collections import defaultdict
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager, nullcontext
+import functools
+import hashlib
 import json
 
+import numpy as np
+from neo4j import AsyncTransaction, READ_ACCESS, unit_of_work
+from neo4j.exceptions import DriverError, Neo4jError
+
 from neo4j_client import Neo4jClient
 from auto_queries import AQ
 from configuration import sys_labels, config
 
 from language_model import LanguageModel
-from embedding_model import Embedder
+from embedding_model import Embedder, EmbeddingMatrix
+from ann_index import ann_indexes
 
 
 def write_list(results: list, item: str = '', head: str = '') -> str:
@@ -42,12 +52,15 @@ class DataRetriever:
 
     def __init__(self, n4j_cli: Neo4jClient,
                  embedder: Embedder,
-                 k_lim: int = 10, thresh: float = 0.65):
+                 k_lim: int = 10, thresh: float = 0.65,
+                 storage: str = 'float32', rescore: int = 0):
         """
         Initialize a DataRetriever that elaborates the database schema
         Args:
             n4j_cli: Neo4J client to connect the database
             llm_agent: LLM agent, used to analyze the user question
+            storage: storage type of the schema embeddings ('float32', 'float16' or 'int8')
+            rescore: with quantized storage, rescore k_lim * rescore candidates with the exact embeddings (0 = no)
         """
         self.n4j_cli: Neo4jClient = n4j_cli
         self.embedder: Embedder = embedder
@@ -60,6 +73,26 @@ class DataRetriever:
             'init': ('dense-klim', 'dense-thresh', 'dense-both'),
             'filter': ('launch',)
         }
+        self.aq_dependencies: dict[str, tuple] = self.check_dependencies()  # dependency graph of the AQs
+        self.use_introspection: bool = config['introspection']  # read the schema with a single query
+        self.introspection_details: bool = config['introspection_details']  # property keys, membership, patterns
+        self.introspection: dict = {}  # last introspection results
+        self.page_size: int = config['page_size']  # paged auto-queries read this many results at a time
+        self.create_pager_index: bool = config['create_pager_index']  # create the index of the pages, if missing
+        self.aq_timeout: float | None = config['aq_timeout']  # seconds after which the server terminates an auto-query
+
+        self.phase_tx: AsyncTransaction | None = None  # read transaction shared by the current phase
+        self.phase_lock = asyncio.Lock()  # a transaction runs one query at a time
+
+        self.indexes: dict = {}  # approximate nearest-neighbour indexes, by AQ name
+        self.index_recall: dict[str, float] = {}  # recall@k of each index against the exact search
+
+        self.storage: str = storage  # storage type of the embeddings
+        self.rescore: int = rescore  # candidates multiplier for the exact rescore
+        if rescore > 0 and storage != 'float32' and embedder.cache is None:
+            print('The exact rescore needs the embedding cache (emb_cache): it is disabled\n')
+            self.rescore = 0
+        self.rescore_margin: float = 0.02  # quantization error tolerated on the threshold before the rescore
 
         self.k_lim = k_lim  # number of elements to retrieve
         self.threshold = thresh  # minimum similarity threshold
@@ -69,8 +102,20 @@ class DataRetriever:
         """
         Close the client
         """
+        self.embedder.save_cache()
         await self.n4j_cli.close()
 
+    @staticmethod
+    def split_modality(modality: str) -> tuple[str, str | None]:
+        """
+        Split the filtering modality from the optional index type (e.g. 'dense-klim/ivf')
+        :return: (modality, index type or None)
+        """
+        if modality is not None and '/' in modality:
+            modality, index_type = modality.split('/', 1)
+            return modality, index_type
+        return modality, None
+
     async def launch_auto_query(self, auto_query: tuple, current_phase: str) -> list:
         """
         Launch an automatic query to the Neo4j server.
@@ -84,11 +129,16 @@ class DataRetriever:
             print('Error: phase not recognized')
             return []
 
-        aq_modality = auto_query[1]  # from configuration.py
+        aq_modality, _ = self.split_modality(auto_query[1])  # from configuration.py
         if aq_modality not in self.phases[current_phase]:
             # Skip current auto-query if not relative to the current phase
             return []
 
+        if self.phase_tx is not None:  # inside read_phase: use the shared transaction
+            async with self.phase_lock:
+                if self.phase_tx is not None:  # not broken by a previous auto-query
+                    return await self.run_auto_query(self.phase_tx, auto_query)
+
         async with self.n4j_cli.driver.session() as session:
             try:
                 aq_name = auto_query[0]
@@ -96,84 +146,414 @@ class DataRetriever:
 
                 if len(auto_query) > 2:  # Query with parameters
                     params = auto_query[2:]
-                    return await session.execute_read(function, *params)
+                    return await session.execute_read(self.with_timeout(function), *params)
                 else:  # Query without parameters
-                    return await session.execute_read(function)
+                    return await session.execute_read(self.with_timeout(function))
             except Exception as err:
                 print(f'{aq_name} is not available! Error: \n{err}\n')
                 return []
 
+    async def run_auto_query(self, tx: AsyncTransaction, auto_query: tuple) -> list:
+        """
+        Run an auto-query inside an open transaction.
+        If it fails, the transaction can't be used anymore: the next auto-queries of the phase open their own sessions
+        """
+        aq_name = auto_query[0]
+        try:
+            function = self.global_AQ_dict[aq_name][AQ.function]
+            params = auto_query[2:]  # empty for queries without parameters
+            return await function(tx, *params)
+        except Exception as err:
+            print(f'{aq_name} is not available! Error: \n{err}\n')
+            if tx is self.phase_tx:
+                self.phase_tx = None  # the shared transaction is broken
+            return []
+
+    def with_timeout(self, function):
+        """
+        Give the auto-query timeout to the transactions of a function run by execute_read
+        """
+        return functools.wraps(function)(unit_of_work(timeout=self.aq_timeout)(function))  # keep the name
+
+    @asynccontextmanager
+    async def read_phase(self) -> AsyncIterator[AsyncTransaction | None]:
+        """
+        Open a single session and read transaction for a whole phase:
+        all the auto-queries launched inside it share them, instead of opening their own.
+        The transaction only reads, so it's rolled back at the end instead of being committed:
+        a failed auto-query doesn't make the whole phase fail.
+        If the transaction can't be opened, the auto-queries open their own sessions (as outside a phase)
+        """
+        async with self.n4j_cli.driver.session(default_access_mode=READ_ACCESS) as session:
+            try:
+                tx = await session.begin_transaction(timeout=self.aq_timeout)
+            except (Neo4jError, DriverError) as err:
+                print(f'Shared read transaction not available, each auto-query opens its own! Error: \n{err}\n')
+                yield None
+                return
+            self.phase_tx = tx
+            try:
+                yield tx
+            finally:
+                self.phase_tx = None
+                try:
+                    await tx.close()  # rollback
+                except (Neo4jError, DriverError) as err:
+                    print(f'Error while closing the read transaction: \n{err}\n')
+
     async def init_full_schema(self) -> None:
         """
-        Initialize the full schema in a structured format, in order to filter it. It includes the embeddings
+        Initialize the full schema in a structured format, in order to filter it. It includes the embeddings.
+        The auto-queries run concurrently: the startup lasts as the slowest one, not as their sum.
+        With config['introspection'], the whole schema is read with a single query
         """
-        for auto_query in self.required_AQs:
+        introspection = await self.introspect() if self.use_introspection else {}
+        self.introspection = introspection
+        matrices = await asyncio.gather(*(self.init_auto_query(auto_query, introspection)
+                                          for auto_query in self.required_AQs))
+
+        for auto_query, matrix in zip(self.required_AQs, matrices):  # keep the configuration order
             aq_name = auto_query[0]  # get AQ name
+            self.full_schema[aq_name] = matrix
 
-            contents = await self.launch_auto_query(auto_query, 'init')  # only the initial queries
-            self.full_schema[aq_name] = await self.embedder.get_list_embeddings(contents)
+            _, index_type = self.split_modality(auto_query[1])
+            if index_type is not None:  # approximate nearest-neighbour index
+                self.indexes[aq_name] = self.build_index(aq_name, index_type, matrix)
 
-    def reset_filter(self):
-        self.filtered_schema = self.full_schema.copy()  # dict(list)
+        self.embedder.save_cache()  # a single write for all the new embeddings
 
-    async def dense_filtering(self, results: list[tuple], question: str, k_lim: int = 10, thresh: float = 0.65):
+    async def introspect(self) -> dict:
         """
-        Dense filtering
+        Read the schema with the introspection auto-query (a single round trip)
+        :return: the introspection fields, or an empty dictionary if the query fails
         """
-        question_emb = await self.embedder.get_embedding(question)
-        res_list = []
+        async with self.n4j_cli.driver.session() as session:
+            try:
+                # paged names are streamed later: don't collect them here
+                return await session.execute_read(self.with_timeout(AQ.schema_introspection),
+                                                  self.page_size == 0, self.introspection_details)
+            except Exception as err:
+                print(f'Schema introspection is not available! Error: \n{err}\n')
+                return {}
+
+    async def fetch_init_contents(self, auto_query: tuple, introspection: dict = None) -> list:
+        """
+        Get the results of an initial auto-query: from the introspection results, if they include them;
+        otherwise, by launching the auto-query
+        """
+        modality, _ = self.split_modality(auto_query[1])
+        field = self.global_AQ_dict.get(auto_query[0], {}).get(AQ.introspection)
+
+        if self.is_paged(auto_query):
+            return [content async for page in self.stream_pages(auto_query) for content in page]
+        if introspection and field in introspection and modality in self.phases['init']:
+            return list(introspection[field])
+        return await self.launch_auto_query(auto_query, 'init')  # only the initial queries
+
+    async def init_auto_query(self, auto_query: tuple, introspection: dict = None) -> EmbeddingMatrix:
+        """
+        Get the results of an initial auto-query and embed them
+        """
+        if self.is_paged(auto_query):
+            return await self.init_paged_auto_query(auto_query)
 
-        for result in results:
-            res_obj, res_emb = result  # : tuple(object, embedding)
-            res_sim = self.embedder.cosine_similarity(question_emb, res_emb)
-            res_list.append((res_obj, res_emb, res_sim))
+        contents = await self.fetch_init_contents(auto_query, introspection)
+        pairs = await self.embedder.get_list_embeddings(contents)
+        return EmbeddingMatrix.from_pairs(pairs, storage=self.storage)
 
-        # res_list format is (object, embedding, similarity)
-        res_list.sort(key=lambda x: x[2], reverse=True)  # sort by descending similarity value
-        out_list = []
+    def is_paged(self, auto_query: tuple) -> bool:
+        """
+        Tell if an initial auto-query is read page by page
+        """
+        modality, _ = self.split_modality(auto_query[1])
+        pager = self.global_AQ_dict.get(auto_query[0], {}).get(AQ.pager)
+        return self.page_size > 0 and pager is not None and modality in self.phases['init']
+
+    async def stream_pages(self, auto_query: tuple) -> AsyncIterator[list]:
+        """
+        Read the results of an auto-query page by page (keyset pagination): each page is a short read transaction
+        """
+        pager = self.global_AQ_dict[auto_query[0]][AQ.pager]
+        pager_index = self.global_AQ_dict[auto_query[0]].get(AQ.pager_index)
+        after = ''
 
-        for triple in res_list:
-            if triple[2] <= thresh:
-                break  # when it goes under the minimum threshold
-            out_list.append((triple[0], triple[1]))  # object and embedding
-            if len(out_list) == k_lim:
-                break  # when it reaches the k = maximum number of allowed elements
-        return out_list
+        async with self.n4j_cli.driver.session() as session:
+            if pager_index is not None:  # the keyset pagination needs an index on the sort key
+                execute = session.execute_write if self.create_pager_index else session.execute_read
+                try:
+                    if not await execute(pager_index, self.create_pager_index):
+                        print(f'No index for {auto_query[0]}: each page will scan all the results '
+                              f'(see config["create_pager_index"])\n')
+                except Neo4jError as err:
+                    print(f'Index for {auto_query[0]} not available: each page will scan all the results! '
+                          f'Error: \n{err}\n')
+            while True:
+                page = await session.execute_read(self.with_timeout(pager), after, self.page_size)
+                if page:
+                    yield page
+                if len(page) < self.page_size:
+                    break  # last page
+                after = page[-1]
+
+    async def init_paged_auto_query(self, auto_query: tuple) -> EmbeddingMatrix:
+        """
+        Stream the results of an auto-query and embed them page by page, while the next pages are arriving.
+        At most two pages wait in the queue, so the memory of the raw results stays bounded
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+
+        async def produce() -> None:
+            try:
+                async for page in self.stream_pages(auto_query):
+                    await queue.put(page)
+            finally:
+                await queue.put(None)  # end of the stream
+
+        producer = asyncio.create_task(produce())
+        parts: list[EmbeddingMatrix] = []
+
+        try:
+            while (page := await queue.get()) is not None:
+                pairs = await self.embedder.get_list_embeddings(page)
+                parts.append(EmbeddingMatrix.from_pairs(pairs, storage=self.storage))
+        except BaseException:
+            producer.cancel()  # don't leave the producer waiting on a full queue
+            raise
+
+        try:
+            await producer
+        except Exception as err:
+            print(f'{auto_query[0]} is not available! Error: \n{err}\n')
+            return EmbeddingMatrix([], [], storage=self.storage)
+        return EmbeddingMatrix.concat(parts, storage=self.storage)
+
+    async def refresh_full_schema(self) -> dict[str, tuple[int, int]]:
+        """
+        Update the full schema after a change of the graph: launch the initial auto-queries again,
+        embed only the new elements and drop the removed ones.
+        The new schema replaces the old one only at the end, so the filtering never sees a partial update.
+        :return: number of (added, removed) elements for each auto-query
+        """
+        AQ.invalidate_properties()  # the graph has changed
+        new_schema = self.full_schema.copy()
+        new_indexes = self.indexes.copy()
+        changes: dict[str, tuple[int, int]] = {}
+        introspection = await self.introspect() if self.use_introspection else {}
+
+        for auto_query in self.required_AQs:
+            aq_name = auto_query[0]
+            modality, index_type = self.split_modality(auto_query[1])
+            if modality not in self.phases['init']:
+                continue
+
+            contents = await self.fetch_init_contents(auto_query, introspection)
+            old_matrix = self.full_schema.get(aq_name)
+            if not isinstance(old_matrix, EmbeddingMatrix):
+                old_matrix = EmbeddingMatrix.from_pairs(old_matrix or [], storage=self.storage)
+
+            old_rows = {content: row for row, content in enumerate(old_matrix.contents)}
+            current = set(contents)
+            kept_rows = sorted(row for content, row in old_rows.items() if content in current)
+            added = [content for content in dict.fromkeys(contents) if content not in old_rows]
+
+            removed = len(old_rows) - len(kept_rows)
+            changes[aq_name] = (len(added), removed)
+            if not added and not removed:
+                continue  # nothing changed
+
+            pairs = await self.embedder.get_list_embeddings(added)  # only the new elements
+            new_schema[aq_name] = old_matrix.updated(kept_rows, pairs)
+
+            if index_type is not None:  # keep the trained clusters, only reassign the rows
+                old_index = self.indexes.get(aq_name)
+                centroids = getattr(old_index, 'centroids', None)
+                new_indexes[aq_name] = self.build_index(aq_name, index_type, new_schema[aq_name], centroids)
+
+        # atomic swap
+        self.full_schema, self.indexes = new_schema, new_indexes
+        if introspection:
+            self.introspection = introspection
+        self.embedder.save_cache()
+        return changes
+
+    def schema_fingerprint(self) -> str:
+        """
+        Hash of the full schema contents: it changes when the graph schema changes.
+        The contents are sorted, since some auto-queries return them in arbitrary order (e.g. from a set)
+        """
+        digest = hashlib.sha256()
+        for aq_name in sorted(self.full_schema.keys()):
+            contents = getattr(self.full_schema[aq_name], 'contents', self.full_schema[aq_name])
+            contents = sorted(json.dumps(content, default=str, sort_keys=True) for content in contents)
+            digest.update(json.dumps([aq_name, contents]).encode('utf-8'))
+        return digest.hexdigest()
+
+    def build_index(self, aq_name: str, index_type: str, embeddings: EmbeddingMatrix, centroids=None):
+        """
+        Build the ANN index of an auto-query and measure its recall@k against the exact search
+        :param centroids: already trained centroids, if any
+        :return: the index (None if the index type doesn't exist)
+        """
+        if index_type not in ann_indexes:
+            print(f'Error: index {index_type} not recognized for {aq_name}')
+            return None
+
+        index = ann_indexes[index_type](embeddings, n_lists=config['ann_lists'], n_probe=config['ann_probes'],
+                                        centroids=centroids)
+        self.index_recall[aq_name] = index.recall_at_k(k=max(1, self.k_lim))
+        return index
+
+    def reset_filter(self):
+        self.filtered_schema = self.full_schema.copy()  # dict(list)
+
+    async def dense_filtering(self, results: EmbeddingMatrix | list[tuple], question: str,
+                              k_lim: int = 10, thresh: float = 0.65,
+                              question_emb: np.ndarray = None, index=None) -> list[tuple]:
+        """
+        Dense filtering: select the elements with a similarity greater than thresh,
+        at most k_lim of them (k_lim = 0 means no limit)
+        :param results: the embedded elements of an auto-query
+        :param question: user question
+        :param question_emb: precomputed question embedding (if None, it's computed here)
+        :param index: approximate nearest-neighbour index of the results (None = exact search)
+        :return: list of (object, embedding), by descending similarity
+        """
+        if not isinstance(results, EmbeddingMatrix):
+            results = EmbeddingMatrix.from_pairs(results)  # : list of (object, embedding)
+
+        if question_emb is None:
+            question_emb = await self.embedder.get_embedding(question)
+        search = index.search if index is not None else results.top_k
+
+        if results.quantized and self.rescore > 0:
+            # approximate scores: take more candidates, then rescore them exactly
+            indexes = await asyncio.to_thread(search, question_emb, k_lim=k_lim * self.rescore,
+                                              thresh=thresh - self.rescore_margin)
+            indexes = await self.exact_rescore(results, indexes, question_emb, k_lim=k_lim, thresh=thresh)
+        else:
+            # NumPy releases the GIL: the independent filters can run in parallel
+            indexes = await asyncio.to_thread(search, question_emb, k_lim=k_lim, thresh=thresh)
+        return [results[i] for i in indexes]
+
+    async def exact_rescore(self, results: EmbeddingMatrix, indexes: list[int], question_emb: np.ndarray,
+                            k_lim: int = 10, thresh: float = 0.65) -> list[int]:
+        """
+        Rescore the candidates of a quantized matrix with their full precision embeddings,
+        read from the embedder cache: the candidates are never embedded again
+        (a candidate missing from the cache keeps its quantized vector)
+        :param indexes: candidate rows
+        :return: the selected rows, by descending exact similarity
+        """
+        if not indexes:
+            return []
+        contents = [results.contents[i] for i in indexes]
+        vectors = results.vectors(np.asarray(indexes))
+        for j, content in enumerate(contents):
+            embedding = self.embedder.cache.get(content) if self.embedder.cache is not None else None
+            if embedding is not None:
+                vectors[j] = embedding  # the rows are normalized by EmbeddingMatrix
+        exact = EmbeddingMatrix(contents, vectors)
+        return [indexes[j] for j in exact.top_k(question_emb, k_lim=k_lim, thresh=thresh)]
 
     async def filter_schema(self, question: str) -> None:
         """
-        Filter the schema with respect to the user query
+        Filter the schema with respect to the user query.
+        The auto-queries run as a dependency graph: each one waits only for the schema entries it needs,
+        the independent ones run concurrently
         :param question: user question
         :return: None (update self.filtered_schema)
         """
-        full_schema: dict = self.full_schema
-        filtered_schema: dict = {}
+        question_emb = await self.embedder.get_embedding(question)  # computed once per question
+        tasks: dict[str, asyncio.Task] = {}
+
+        async def run(auto_query: tuple) -> list:
+            dependencies = [dep for dep in self.aq_dependencies.get(auto_query[0], ()) if dep in tasks]
+            inputs = dict(zip(dependencies, await asyncio.gather(*(tasks[dep] for dep in dependencies))))
+            return await self.filter_auto_query(auto_query, question, question_emb, inputs)
+
+        needs_db = any(self.split_modality(auto_query[1])[0] in self.phases['filter']
+                       for auto_query in self.required_AQs)
 
+        # one read transaction for all the auto-queries of the question
+        async with self.read_phase() if needs_db else nullcontext():
+            for auto_query in self.required_AQs:  # all the tasks exist before the first one starts
+                tasks[auto_query[0]] = asyncio.create_task(run(auto_query))
+            await asyncio.gather(*tasks.values())
+
+        # keep the configuration order
+        self.filtered_schema = {aq_name: task.result() for aq_name, task in tasks.items()}
+
+    async def filter_names(self, question: str) -> set[str]:
+        """
+        Names selected by the NAMES filtering for a question, without launching the other auto-queries
+        (e.g. to check a cached query before the whole filtering)
+        """
         for auto_query in self.required_AQs:
-            aq_name = auto_query[0]
-            filter_mode = auto_query[1]
+            if auto_query[0] == 'NAMES':
+                question_emb = await self.embedder.get_embedding(question)
+                selected = await self.filter_auto_query(auto_query, question, question_emb, {})
+                return {name for name, _ in selected}
+        return set()
+
+    async def filter_auto_query(self, auto_query: tuple, question: str, question_emb: np.ndarray,
+                                inputs: dict) -> list:
+        """
+        Filter the results of a single auto-query
+        :param auto_query: the auto-query, from the configuration
+        :param question: user question
+        :param question_emb: question embedding
+        :param inputs: filtered schema entries required by the auto-query
+        :return: the filtered results
+        """
+        full_schema: dict = self.full_schema
+        aq_name = auto_query[0]
+        filter_mode, _ = self.split_modality(auto_query[1])
+        index = self.indexes.get(aq_name)
+
+        if filter_mode == 'dense-klim':
+            return await self.dense_filtering(full_schema[aq_name], question, k_lim=self.k_lim, thresh=0,
+                                              question_emb=question_emb, index=index)
 
-            if filter_mode == 'dense-klim':
-                filtered_schema[aq_name] = await (
-                    self.dense_filtering(full_schema[aq_name], question, k_lim=self.k_lim, thresh=0))
+        elif filter_mode == 'dense-thresh':
+            return await self.dense_filtering(full_schema[aq_name], question, k_lim=0, thresh=self.threshold,
+                                              question_emb=question_emb, index=index)
 
-            elif filter_mode == 'dense-thresh':
-                filtered_schema[aq_name] = await (
-                    self.dense_filtering(full_schema[aq_name], question, k_lim=0, thresh=self.threshold))
+        elif filter_mode == 'dense-both':
+            return await self.dense_filtering(full_schema[aq_name], question, k_lim=self.k_lim,
+                                              thresh=self.threshold, question_emb=question_emb, index=index)
 
-            elif filter_mode == 'dense-both':
-                filtered_schema[aq_name] = await (
-                    self.dense_filtering(full_schema[aq_name], question, k_lim=self.k_lim, thresh=self.threshold))
+        elif filter_mode == 'launch':
+            auto_query = list(auto_query)
+            auto_query[2] = inputs
+            return await self.launch_auto_query(tuple(auto_query), 'filter')
+
+        else:  # == None -> no filtering needed
+            return full_schema[aq_name]
+
+    def check_dependencies(self) -> dict[str, tuple]:
+        """
+        Read the dependencies of the required auto-queries and check that they don't form a cycle
+        :return: the dependencies of each auto-query
+        """
+        dependencies = {
+            auto_query[0]: self.global_AQ_dict.get(auto_query[0], {}).get(AQ.dependencies, ())
+            for auto_query in self.required_AQs
+        }
 
-            elif filter_mode == 'launch':
-                auto_query = list(auto_query)
-                auto_query[2] = filtered_schema
-                filtered_schema[aq_name] = await self.launch_auto_query(tuple(auto_query), 'filter')
+        visited: set = set()
 
-            else:  # == None -> no filtering needed
-                filtered_schema[aq_name] = full_schema[aq_name]
+        def visit(aq_name: str, path: tuple) -> None:
+            if aq_name in path:
+                raise ValueError(f"Error: cyclic auto-query dependencies: {' -> '.join(path + (aq_name,))}")
+            if aq_name in visited or aq_name not in dependencies:
+                return
+            for dep in dependencies[aq_name]:
+                visit(dep, path + (aq_name,))
+            visited.add(aq_name)
 
-        self.filtered_schema = filtered_schema
+        for name in dependencies:
+            visit(name, ())
+        return dependencies
 
     def transcribe_schema(self, intro: str = None, filtered: bool = True) -> str:
         """
@@ -0,0 +1,185 @@
+import re
+
+# Administration and schema commands: their literals (names, options) can't be parameters
+ADMIN_COMMAND = re.compile(
+    r'^\s*(SHOW|TERMINATE|ALTER|GRANT|REVOKE|DENY|START|STOP|ENABLE|DRYRUN'
+    r'|(CREATE|DROP)(\s+OR\s+REPLACE)?\s+(\w+\s+)?(INDEX|CONSTRAINT|DATABASE|ALIAS|USER|ROLE|SERVER))\b',
+    re.IGNORECASE
+)
+NUMBER = re.compile(r'\d+(\.\d+)?([eE][+-]?\d+)?')
+PARAMETER = re.compile(r'\$`?(\w+)')
+PATH_LENGTH = re.compile(r'\*\s*\d*\s*(\.\.\s*\d*)?')  # e.g. *, *2, *1..3, * 1 .. 3
+QUANTIFIER = re.compile(r'\{\s*(\d+\s*(,\s*\d*)?|,\s*\d+)\s*\}')  # quantified paths, e.g. {1,3} (maps have keys)
+# Projections: the text of an un-aliased item is the name of its result column
+PROJECTION = re.compile(r'\b(RETURN|WITH)\b(\s+DISTINCT\b)?', re.IGNORECASE)
+CLAUSE = re.compile(
+    r'(ORDER\s+BY|SKIP|LIMIT|OFFSET|WHERE|UNION|OPTIONAL|MATCH|CREATE|MERGE|SET|DELETE|DETACH|REMOVE|UNWIND|CALL'
+    r'|WITH|RETURN|FOREACH|USE|FINISH)\b',
+    re.IGNORECASE
+)
+ALIAS = re.compile(r'\bAS\s+(\w+|`[^`]*`)\s*$', re.IGNORECASE)
+ESCAPES = {'t': '\t', 'b': '\b', 'n': '\n', 'r': '\r', 'f': '\f', "'": "'", '"': '"', '\\': '\\'}
+
+
+def unescape(literal: str) -> str:
+    """
+    Value of a Cypher string literal (quotes excluded)
+    """
+    def replace(match: re.Match) -> str:
+        escape = match.group(1)
+        if escape[0] in 'uU':
+            return chr(int(escape[1:], 16))
+        return ESCAPES.get(escape, '\\' + escape)
+
+    return re.sub(r'\\(u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|.)', replace, literal, flags=re.DOTALL)
+
+
+def mask(query: str) -> str:
+    """
+    Blank out comments, string literals and quoted names (keeping their quotes and the positions),
+    so that the query structure can be read with regular expressions
+    """
+    masked = list(query)
+    i, n = 0, len(query)
+    while i < n:
+        if query.startswith('//', i):
+            end = query.find('\n', i)
+            end = n if end < 0 else end
+            start, stop = i, end
+        elif query.startswith('/*', i):
+            end = query.find('*/', i + 2)
+            end = n if end < 0 else end + 2
+            start, stop = i, end
+        elif query[i] in '`\'"':
+            match = re.compile(rf'{query[i]}((?:\\.|[^{query[i]}\\])*){query[i]}', re.DOTALL).match(query, i)
+            end = n if match is None else match.end()
+            start, stop = i + 1, end - 1
+        else:
+            i += 1
+            continue
+        masked[start:stop] = '_' * (stop - start)
+        i = max(end, i + 1)
+    return ''.join(masked)
+
+
+def projection_spans(query: str) -> list[tuple[int, int]]:
+    """
+    Spans of the un-aliased items of the RETURN and WITH clauses: their literals name the result columns
+    (e.g. RETURN count(n) > 0), so they must stay as they are
+    """
+    masked = mask(query)
+    spans = []
+    for match in PROJECTION.finditer(masked):
+        if re.search(r'\b(STARTS|ENDS)\s+$', masked[:match.start()], re.IGNORECASE):
+            continue  # string operator, not a clause
+        start = i = match.end()
+        depth = 0
+        items = []
+        while i < len(masked):
+            char = masked[i]
+            if char in '([{':
+                depth += 1
+            elif char in ')]}':
+                depth -= 1
+                if depth < 0:  # end of a subquery
+                    break
+            elif depth == 0 and char == ',':
+                items.append((start, i))
+                start = i + 1
+            elif depth == 0 and (char == ';' or (not (masked[i - 1].isalnum() or masked[i - 1] in '_$.')
+                                                 and CLAUSE.match(masked, i))):
+                break  # next clause
+            i += 1
+        items.append((start, i))
+        spans.extend((first, last) for first, last in items if not ALIAS.search(masked, first, last))
+    return spans
+
+
+def extract_literals(query: str, reserved: set[str] = frozenset(), prefix: str = 'p') -> tuple[str, dict]:
+    """
+    Lift the string and number literals of a query into parameters ($p0, $p1...), so that
+    structurally identical queries have the same text and share one cached plan.
+    Comments, quoted names, the bounds of variable-length relationships (-[*1..3]-) and quantified paths ({1,3})
+    and the literals of the un-aliased RETURN/WITH items (they name the result columns) are kept as they are.
+    :param query: Cypher query
+    :param reserved: parameter names already in use
+    :param prefix: prefix of the new parameter names
+    :return: the parameterized query and the values of its new parameters
+    """
+    if ADMIN_COMMAND.match(query):
+        return query, {}
+
+    reserved = set(reserved) | set(PARAMETER.findall(query))
+    kept = projection_spans(query)
+    params = {}
+    output = []
+    count = 0
+
+    def add_parameter(value) -> str:
+        nonlocal count
+        while f'{prefix}{count}' in reserved:
+            count += 1
+        name = f'{prefix}{count}'
+        count += 1
+        params[name] = value
+        return '$' + name
+
+    brackets = []  # for each open '[': True if it's a relationship pattern
+    i, n = 0, len(query)
+    while i < n:
+        char = query[i]
+
+        if query.startswith('//', i):  # line comment
+            end = query.find('\n', i)
+            end = n if end < 0 else end
+            output.append(query[i:end])
+        elif query.startswith('/*', i):  # block comment
+            end = query.find('*/', i + 2)
+            end = n if end < 0 else end + 2
+            output.append(query[i:end])
+        elif char == '`':  # quoted name
+            end = query.find('`', i + 1)
+            end = n if end < 0 else end + 1
+            output.append(query[i:end])
+        elif char in '\'"':  # string literal
+            match = re.compile(rf'{char}((?:\\.|[^{char}\\])*){char}', re.DOTALL).match(query, i)
+            if match is None:  # unterminated: the server will report it
+                output.append(query[i:])
+                end = n
+            elif any(first <= i < last for first, last in kept):
+                end = match.end()
+                output.append(query[i:end])
+            else:
+                output.append(add_parameter(unescape(match.group(1))))
+                end = match.end()
+        elif char == '*' and brackets and brackets[-1]:  # path length of a relationship pattern
+            end = PATH_LENGTH.match(query, i).end()
+            output.append(query[i:end])
+        elif char == '{' and QUANTIFIER.match(query, i):
+            end = QUANTIFIER.match(query, i).end()
+            output.append(query[i:end])
+        elif char.isdigit() and (i == 0 or not (query[i - 1].isalnum() or query[i - 1] in '_$'
+                                                or (query[i - 1] == '.' and not query.startswith('..', i - 2)))):
+            end = NUMBER.match(query, i).end()
+            if end < n and (query[end].isalnum() or query[end] == '_'):  # e.g. hexadecimal: keep it
+                end = re.compile(r'\w*').match(query, end).end()
+                output.append(query[i:end])
+            elif any(first <= i < last for first, last in kept):
+                output.append(query[i:end])
+            else:
+                number = query[i:end]
+                output.append(add_parameter(int(number) if number.isdigit() else float(number)))
+        else:
+            if char == '[':  # a relationship pattern follows a dash: -[...]- or <-[...]-
+                brackets.append(query[:i].rstrip().endswith('-'))
+            elif char == ']' and brackets:
+                brackets.pop()
+            output.append(char)
+            end = i + 1
+        i = end
+
+    return ''.join(output), params
+
+
+if __name__ == "__main__":
+    pass
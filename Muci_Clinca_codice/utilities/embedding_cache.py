@@ -0,0 +1,196 @@
+import glob
+import hashlib
+import os
+import re
+import struct
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Persistent content-addressed store for the embeddings, keyed by (embedder name, text hash).
+    Each embedder has its own folder of segment files; each save() writes only the new entries, as a new segment.
+    A segment is made of:
+        - header: magic string, vector dimension, number of entries
+        - keys: one 16-byte hash for each entry
+        - vectors: float32 matrix (entries x dimension)
+    The segments are memory-mapped, so a warm start costs a few file opens.
+    As in a log-structured merge, the newest segment is merged with the previous ones while they aren't bigger:
+    there are O(log N) segments, and each entry is rewritten O(log N) times in total.
+    """
+    magic = b'EMBCACHE'
+    header = struct.Struct('<8sII')  # magic, dimension, count
+    key_size = 16
+    flush_bytes = 32_000_000  # size of the unsaved entries that triggers a save in the middle of a long embedding
+
+    def __init__(self, directory: str, embedder_name: str):
+        """
+        Initialize the cache and load the existing entries, if any
+        :param directory: folder that contains the cache files
+        :param embedder_name: name of the embedding model
+        """
+        self.embedder_name: str = embedder_name
+        safe_name = re.sub(r'[^\w.-]', '_', embedder_name)
+        self.folder: str = os.path.join(directory, safe_name)
+        self.legacy_path: str = os.path.join(directory, safe_name + '.emb')  # single file of the previous layout
+
+        self.dim: int = 0
+        self.index: dict[bytes, tuple[int, int]] = {}  # hash -> (segment, row)
+        self.segments: list[np.ndarray] = []  # memory-mapped matrices
+        self.segment_keys: list[np.ndarray] = []  # memory-mapped keys
+        self.segment_paths: list[str] = []
+        self.pending: dict[bytes, np.ndarray] = {}  # new entries (float32, as on disk), not yet saved
+
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self.index) + len(self.pending)
+
+    @property
+    def pending_bytes(self) -> int:
+        """
+        Memory held by the unsaved entries
+        """
+        return len(self.pending) * (self.dim * 4 + self.key_size)
+
+    def key(self, text: str) -> bytes:
+        """
+        Content address of a text, for the current embedder
+        """
+        content = f'{self.embedder_name}\0{text}'.encode('utf-8')
+        return hashlib.sha256(content).digest()[:self.key_size]
+
+    def segment_files(self) -> list[str]:
+        """
+        Segment files, oldest first
+        """
+        files = sorted(glob.glob(os.path.join(self.folder, 'segment-*.emb')))
+        if os.path.isfile(self.legacy_path):
+            files.insert(0, self.legacy_path)
+        return files
+
+    def next_segment_path(self) -> str:
+        numbers = [int(re.search(r'segment-(\d+)\.emb$', path).group(1))
+                   for path in self.segment_paths if path != self.legacy_path]
+        return os.path.join(self.folder, f'segment-{max(numbers, default=-1) + 1:06d}.emb')
+
+    def read_segment(self, path: str) -> tuple[np.ndarray, np.ndarray] | None:
+        """
+        Memory-map the keys and the vectors of a segment
+        """
+        with open(path, 'rb') as segment_file:
+            magic, dim, count = self.header.unpack(segment_file.read(self.header.size))
+        if magic != self.magic or count == 0:
+            return None
+
+        keys_offset = self.header.size
+        vectors_offset = keys_offset + count * self.key_size
+        keys = np.memmap(path, dtype=f'V{self.key_size}', mode='r', offset=keys_offset, shape=(count,))
+        vectors = np.memmap(path, dtype=np.float32, mode='r', offset=vectors_offset, shape=(count, dim))
+        return keys, vectors
+
+    def add_segment(self, path: str) -> None:
+        """
+        Load a segment and index its entries (the newest entries win)
+        """
+        segment = self.read_segment(path)
+        if segment is None:
+            return
+        keys, vectors = segment
+        if self.dim and vectors.shape[1] != self.dim:
+            return  # written by a different embedder version: don't mix the vectors
+        self.dim = vectors.shape[1]
+
+        number = len(self.segments)
+        self.segments.append(vectors)
+        self.segment_keys.append(keys)
+        self.segment_paths.append(path)
+        for row, key in enumerate(keys):
+            self.index[key.tobytes()] = (number, row)
+
+    def load(self) -> None:
+        """
+        Memory-map all the segments
+        """
+        self.index, self.segments, self.segment_keys, self.segment_paths = {}, [], [], []
+        for path in self.segment_files():
+            self.add_segment(path)
+
+    def get(self, text: str) -> np.ndarray | None:
+        """
+        Return the cached embedding of the text, or None
+        """
+        key = self.key(text)
+        if key in self.pending:
+            return np.array(self.pending[key], dtype=np.float64)
+        location = self.index.get(key)
+        if location is None:
+            return None
+        segment, row = location
+        return np.array(self.segments[segment][row], dtype=np.float64)
+
+    def put(self, text: str, embedding: np.ndarray) -> None:
+        """
+        Add a new embedding; it will be written on disk by save()
+        """
+        if self.dim and len(embedding) != self.dim:
+            return  # different dimension: the embedder has changed, don't mix the vectors
+        self.dim = len(embedding)
+        self.pending[self.key(text)] = np.asarray(embedding, dtype=np.float32)
+
+    def write_segment(self, path: str, keys: list[bytes], matrix: np.ndarray) -> None:
+        """
+        Write a segment file; it's replaced atomically, so a crash never leaves a broken segment
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as segment_file:
+            segment_file.write(self.header.pack(self.magic, self.dim, len(keys)))
+            segment_file.write(b''.join(keys))
+            segment_file.write(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+        os.replace(tmp_path, path)
+
+    def save(self) -> None:
+        """
+        Write the new entries as a new segment: the existing segments are not read nor rewritten
+        """
+        if not self.pending:
+            return
+
+        path = self.next_segment_path()
+        self.write_segment(path, list(self.pending.keys()), np.asarray(list(self.pending.values())))
+        self.pending = {}
+        self.add_segment(path)
+
+        first = len(self.segments) - 1
+        while first > 0 and len(self.segments[first - 1]) <= sum(len(vectors) for vectors in self.segments[first:]):
+            first -= 1
+        if first < len(self.segments) - 1:
+            self.merge(first)
+
+    def merge(self, first: int) -> None:
+        """
+        Merge the segments from first to the newest into a single one (the older segments are not touched)
+        """
+        keys, parts = [], []
+        for segment in range(first, len(self.segments)):
+            segment_keys = [key.tobytes() for key in self.segment_keys[segment]]
+            rows = [row for row, key in enumerate(segment_keys) if self.index[key] == (segment, row)]  # newest only
+            keys.extend(segment_keys[row] for row in rows)
+            parts.append(np.asarray(self.segments[segment][rows], dtype=np.float32))
+        matrix = np.concatenate(parts)
+
+        old_paths = self.segment_paths[first:]
+        path = self.next_segment_path()
+        self.write_segment(path, keys, matrix)
+
+        # release the old mappings, then load the merged segment
+        del self.segments[first:], self.segment_keys[first:], self.segment_paths[first:]
+        for old_path in old_paths:
+            os.remove(old_path)
+        self.add_segment(path)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,98 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    """
+    In-memory cache with least-recently-used eviction, an optional time-to-live and an optional byte budget
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = None, max_bytes: int = None):
+        """
+        :param max_size: maximum number of entries (0 = cache disabled)
+        :param ttl: seconds after which an entry expires (None = never)
+        :param max_bytes: maximum total size of the entries, as declared in put() (None = no limit)
+        """
+        self.max_size: int = max(0, max_size)
+        self.ttl: float | None = ttl
+        self.max_bytes: int | None = max_bytes
+        self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()  # key -> (insertion time, value)
+        self.sizes: dict[Hashable, int] = {}  # key -> size in bytes
+        self.total_bytes: int = 0
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries and not self.expired(key)
+
+    def expired(self, key: Hashable) -> bool:
+        return self.ttl is not None and time.monotonic() - self.entries[key][0] > self.ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Return the cached value (and mark it as recently used), or default
+        """
+        if key in self.entries and self.expired(key):
+            self.remove(key)
+
+        if key not in self.entries:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key][1]
+
+    def put(self, key: Hashable, value: Any, size: int = 0) -> None:
+        """
+        Store a value, evicting the least recently used entries if the cache is full
+        :param size: size of the value in bytes, counted in the byte budget
+        """
+        if self.max_size == 0 or (self.max_bytes is not None and size > self.max_bytes):
+            return
+        self.remove(key)
+        self.entries[key] = (time.monotonic(), value)
+        self.sizes[key] = size
+        self.total_bytes += size
+
+        while len(self.entries) > self.max_size or \
+                (self.max_bytes is not None and self.total_bytes > self.max_bytes):
+            self.remove(next(iter(self.entries)))  # least recently used
+
+    def remove(self, key: Hashable) -> None:
+        if key in self.entries:
+            del self.entries[key]
+            self.total_bytes -= self.sizes.pop(key)
+
+    def invalidate(self, keys: list[Hashable] = None) -> None:
+        """
+        Remove some entries (None = all of them)
+        """
+        if keys is None:
+            self.entries.clear()
+            self.sizes.clear()
+            self.total_bytes = 0
+            return
+        for key in keys:
+            self.remove(key)
+
+    def info(self) -> dict:
+        """
+        Statistics of the cache
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'bytes': self.total_bytes,
+        }
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,90 @@
+import asyncio
+import datetime
+import json
+import logging
+import statistics
+
+from configuration import config
+from embedding_model import Embedder
+from language_model import LanguageModel
+from neo4j_client import Neo4jClient
+from retriever import DataRetriever
+
+# UTILITY FILE
+# Compare the prompt evaluation time of the prompt layouts on the test queries.
+# Run it from the Muci_Clinca_codice folder: python -m utilities.prompt_benchmark
+
+INPUT_FILE = 'inputs/Queries_with_ID.json'
+OUTPUT_FILE = 'outputs/prompt_benchmark.txt'
+
+
+def question_ids(query_ids: list) -> list[int]:
+    """
+    Expand the (first, last) ranges of config['test_queries']
+    """
+    ids = []
+    for query_id in query_ids:
+        if isinstance(query_id, int):
+            ids.append(query_id)
+        elif isinstance(query_id, tuple):
+            ids.extend(range(query_id[0], query_id[1] + 1))
+    return ids
+
+
+async def main() -> None:
+    logging.getLogger("neo4j").setLevel(logging.ERROR)
+
+    client = Neo4jClient(user=config['n4j_usr'], password=config['n4j_psw'], uri=config['n4j_url'])
+    embedder = Embedder(config['embedder'], cache_dir=config['emb_cache'])
+    retriever = DataRetriever(n4j_cli=client, embedder=embedder, k_lim=config['k_lim'], thresh=config['thresh'])
+    await retriever.init_full_schema()
+
+    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
+        test_queries = json.load(f)
+
+    # The filtered schemas don't depend on the layout: compute them once
+    questions = []
+    for tq in question_ids(config['test_queries']):
+        question = test_queries[tq]['query']
+        retriever.reset_filter()
+        await retriever.filter_schema(question=question)
+        questions.append((question, retriever.transcribe_schema(filtered=True)))
+
+    # A single generated token: the whole stream is read, so its last chunk reports the prompt evaluation
+    # (write_cypher_query would close the stream as soon as the query is complete)
+    generation = {'cypher': {'think': False, 'num_predict': 1}}
+
+    results = {}
+    for layout in LanguageModel.layouts:
+        llm_agent = LanguageModel(model_name=config['llm'], examples=config['examples'], layout=layout,
+                                  generation=generation)
+        stats = []
+        for question, schema in questions:
+            async for _ in llm_agent.launch_chat(query=question, prompt_upd=config['question_prompt'],
+                                                 context=schema, stage='cypher'):
+                pass
+            if llm_agent.prompt_stats:  # missing if the chat failed
+                stats.append(llm_agent.prompt_stats)
+            print(f'{layout}: {llm_agent.prompt_stats}')
+        results[layout] = stats
+
+    await retriever.close()
+
+    with open(OUTPUT_FILE, 'w') as outfile:
+        print(f'Prompt benchmark: {datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")}', file=outfile)
+        print(f'LLM: {config["llm"]}, questions: {len(questions)}\n', file=outfile)
+        for layout, stats in results.items():
+            if not stats:
+                print(f'{layout}: no results', file=outfile)
+                continue
+            warm = stats[1:] or stats  # the first question always evaluates the whole prompt
+            print(f'{layout}:', file=outfile)
+            print(f'\tfirst question: {stats[0]["prompt_tokens"]} tokens, '
+                  f'{stats[0]["prompt_eval_ms"]:.1f} ms', file=outfile)
+            print(f'\tnext questions (mean): {statistics.mean(s["prompt_tokens"] for s in warm):.1f} tokens, '
+                  f'{statistics.mean(s["prompt_eval_ms"] for s in warm):.1f} ms', file=outfile)
+    print(f'Results written in {OUTPUT_FILE}')
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
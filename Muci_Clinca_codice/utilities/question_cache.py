@@ -0,0 +1,149 @@
+import json
+import os
+import re
+
+import numpy as np
+
+from embedding_model import Embedder, EmbeddingMatrix
+from utilities.cypher_literals import extract_literals
+from utilities.lru_cache import LRUCache
+
+
+class QuestionCache:
+    """
+    Semantic cache of the generated queries: question -> validated Cypher query.
+    A new question reuses the query of the most similar cached question, if their similarity is above the threshold
+    and they mention the same numbers (e.g. 'room 1' and 'room 2' are similar, but need different queries);
+    besides, every string literal of the cached query must be one of the names selected for the new question,
+    or appear in its words (e.g. 'kitchen light' and 'bedroom light' are similar, but need different names).
+    The cache is saved as a JSON file; the embeddings of the questions come from the Embedder (and its disk cache).
+    All the entries are dropped when the database schema changes.
+    """
+    numbers = re.compile(r'\d+(?:\.\d+)?')
+    separators = re.compile(r'[\W_]+')
+
+    @staticmethod
+    def words(text: str) -> str:
+        """
+        Lowercase words of a text, separated and surrounded by single spaces (e.g. 'Kitchen_Light' -> ' kitchen light ')
+        """
+        return f' {QuestionCache.separators.sub(" ", text.lower()).strip()} '
+
+    @staticmethod
+    def mentions_literals(question: str, cypher: str, names: set[str] = frozenset()) -> bool:
+        """
+        Tell if all the string literals of a query fit the question: each one is a selected name or appears in it
+        :param names: names selected for the question (e.g. 'Coffee_machine_1' for 'Is the coffee maker on?')
+        """
+        question_words = QuestionCache.words(question)
+        _, literals = extract_literals(cypher)
+        literals = [value for value in literals.values() if isinstance(value, str) and value not in names]
+        literal_words = [QuestionCache.words(value) for value in literals]
+        return all(words in question_words for words in literal_words if words.strip())  # e.g. not punctuation
+
+    def __init__(self, embedder: Embedder, path: str = None, max_size: int = 256, threshold: float = 0.95):
+        """
+        :param embedder: embedding model of the questions
+        :param path: JSON file of the cache (None = not persistent)
+        :param max_size: maximum number of cached questions (0 = cache disabled)
+        :param threshold: minimum cosine similarity to reuse a query
+        """
+        self.embedder: Embedder = embedder
+        self.path: str | None = path
+        self.threshold: float = threshold
+        self.entries = LRUCache(max_size=max_size)  # question -> (query, normalized embedding)
+        self.schema: str | None = None  # fingerprint of the schema the queries were written for
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    async def load(self, schema: str) -> None:
+        """
+        Load the cached questions from the JSON file and embed them
+        :param schema: fingerprint of the current schema: the stored queries are loaded only if it hasn't changed
+        """
+        self.schema = schema
+        if self.path is None or not os.path.isfile(self.path):
+            return
+
+        with open(self.path, 'r', encoding='utf-8') as cache_file:
+            stored = json.load(cache_file)
+        if stored.get('schema') != schema:
+            return  # written for another schema
+
+        queries = {entry['question']: entry['cypher'] for entry in stored.get('entries', [])}
+        pairs = await self.embedder.get_list_embeddings(list(queries))
+        for question, embedding in pairs:  # least recently used first
+            self.entries.put(question, (queries[question], EmbeddingMatrix.normalize(embedding)))
+
+    def set_schema(self, fingerprint: str) -> None:
+        """
+        Set the current schema: if it has changed, the cached queries are dropped
+        """
+        if self.schema is not None and fingerprint != self.schema:
+            self.entries.invalidate()
+        self.schema = fingerprint
+
+    async def lookup(self, question: str, names: set[str] = frozenset()) -> str | None:
+        """
+        Find the query of the most similar cached question
+        :param names: names selected for the question by the schema filtering
+        :return: the cached query, or None
+        """
+        if len(self.entries) == 0:
+            self.entries.misses += 1
+            return None
+        if question in self.entries:
+            return self.entries.get(question)[0]
+
+        question_emb = EmbeddingMatrix.normalize(await self.embedder.get_embedding(question))
+        numbers = self.numbers.findall(question)
+
+        best, best_score = None, self.threshold
+        for cached_question, (_, (cypher, embedding)) in self.entries.entries.items():  # key -> (time, value)
+            if self.numbers.findall(cached_question) != numbers or not self.mentions_literals(question, cypher, names):
+                continue
+            score = float(np.dot(question_emb, embedding))
+            if score >= best_score:
+                best, best_score = cached_question, score
+
+        if best is None:
+            self.entries.misses += 1
+            return None
+        return self.entries.get(best)[0]  # counts the hit and marks the entry as recently used
+
+    async def put(self, question: str, cypher: str) -> None:
+        """
+        Cache the validated query of a question
+        """
+        if self.entries.max_size == 0 or not cypher:
+            return
+        embedding = EmbeddingMatrix.normalize(await self.embedder.get_embedding(question))
+        self.entries.put(question, (cypher, embedding))
+
+    def save(self) -> None:
+        """
+        Write the cache file; it's replaced atomically
+        """
+        if self.path is None:
+            return
+        stored = {
+            'schema': self.schema,
+            'entries': [{'question': question, 'cypher': cypher}
+                        for question, (_, (cypher, _)) in self.entries.entries.items()],
+        }
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as cache_file:
+            json.dump(stored, cache_file, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def info(self) -> dict:
+        """
+        Statistics of the cache
+        """
+        return self.entries.info()
+
+
+if __name__ == "__main__":
+    pass